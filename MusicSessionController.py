@@ -1,52 +1,47 @@
 import asyncio
-import pyaudio
+from datetime import datetime
 from google import genai
 from google.genai import types
 
 import utils
+from app.chats.audio_sinks import SpeakerSink
+from app.chats.wav_writer import WavFileSink
 
-BUFFER_SECONDS = 1
-CHUNK = 4200
-FORMAT = pyaudio.paInt16
-CHANNELS = 2
 MODEL = "models/lyria-realtime-exp"
-OUTPUT_RATE = 48_000
 MAX_PLAY_SECONDS = 30
 
 class MusicSessionController:
     def __init__(self, api_key):
         self.api_key = api_key
         self.client = genai.Client(api_key=api_key, http_options={"api_version": "v1alpha"})
-        self.pcm_buffer = bytearray()
-        self.pa = pyaudio.PyAudio()
+        self.sink = SpeakerSink()
+        # Records the session to disk while it plays; main.py decides whether to keep it
+        ts = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.recorder = WavFileSink(utils.DOWNLOAD_DIR / f"lyria_{ts}.wav")
         self.config = types.LiveMusicGenerationConfig()
         self.session = None
         self.auto_stop_task = None
 
     async def receive(self):
         chunks = 0
-        stream = self.pa.open(
-            format=FORMAT,
-            channels=CHANNELS,
-            rate=OUTPUT_RATE,
-            output=True,
-            frames_per_buffer=CHUNK,
-        )
+        self.sink.open()
+        self.recorder.open()
         try:
             async for msg in self.session.receive():
                 if msg.server_content:
                     if chunks == 0:
-                        await asyncio.sleep(BUFFER_SECONDS)
+                        await asyncio.sleep(self.sink.buffer_seconds)
                     chunks += 1
                     data = msg.server_content.audio_chunks[0].data
-                    stream.write(data)
-                    self.pcm_buffer.extend(data)
+                    self.sink.write(data)
+                    self.recorder.write(data)
                 elif msg.filtered_prompt:
                     print("Prompt filtered:", msg.filtered_prompt)
         except asyncio.CancelledError:
             pass
         finally:
-            stream.close()
+            self.sink.close()
+            self.recorder.close()
 
     async def send(self):
         await asyncio.sleep(5)
@@ -130,4 +125,4 @@ class MusicSessionController:
 
     async def close(self):
         await self.session.__aexit__(None, None, None)
-        self.pa.terminate()
\ No newline at end of file
+        self.sink.terminate()
\ No newline at end of file
@@ -5,20 +5,31 @@ from .config import Config
 from flask_migrate import Migrate
 from authlib.integrations.flask_client import OAuth
 from flask_jwt_extended import JWTManager
+from .chats.executor import GenerationExecutor
 
 db = SQLAlchemy()
 migrate = Migrate()
 oauth = OAuth()
 jwt = JWTManager() # Initialize JWTManager globally
+generation_executor = GenerationExecutor()
 
 def create_app():
     app = Flask(__name__)
-    CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
+    CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}},
+         expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "ETag", "Retry-After", "X-Next-Cursor", "Idempotent-Replayed"])
     app.config.from_object(Config)
     db.init_app(app)
     migrate.init_app(app, db)
     oauth.init_app(app)
     jwt.init_app(app) # Bind JWTManager to the app
+    generation_executor.init_app(app)
+    from .identity import identity_cache
+    identity_cache.init_app(app)
+
+    # Tokens resolve to a cached user, so jwt_required routes don't query it on every request
+    @jwt.user_lookup_loader
+    def user_lookup_callback(jwt_header, jwt_payload):
+        return identity_cache.user(jwt_payload["sub"])
 
     # Custom JWT error handlers for logging
     @jwt.unauthorized_loader
@@ -71,6 +82,31 @@ def create_app():
         client_kwargs={'scope': 'user:email'}
     )
 
+    from app.google_certs import google_certs
+    google_certs.init_app(app)
+    from app.chats.jobs import job_tracker
+    job_tracker.init_app(app)
+    from app.chats.blob_store import blob_store
+    blob_store.init_app(app)
+    from app.chats.clip_encoder import clip_encoder
+    clip_encoder.init_app(app)
+    from app.chats.waveforms import waveform_peaks
+    waveform_peaks.init_app(app)
+    from app.chats.generation_cache import generation_cache
+    generation_cache.init_app(app)
+    from app.chats.separation import separation_scheduler
+    separation_scheduler.init_app(app)
+    from app.chats.stem_manifests import stem_manifests
+    stem_manifests.init_app(app)
+    from app.chats.stem_cache import stem_cache
+    stem_cache.init_app(app)
+    from app.chats.mix_cache import mix_cache
+    mix_cache.init_app(app)
+    from app.chats.cleanup import file_cleanup
+    file_cleanup.init_app(app)
+    from app.chats.retention import retention_collector
+    retention_collector.init_app(app)
+
     from app.chats.routes import routes_bp
     app.register_blueprint(routes_bp)
 
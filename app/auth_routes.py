@@ -1,10 +1,8 @@
 from flask import Blueprint, jsonify, request
 from werkzeug.security import generate_password_hash, check_password_hash
 from .models import User, db
-from google.oauth2 import id_token as google_id_token
-from google.auth.transport import requests as google_requests
-from .config import Config
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from .google_certs import google_certs
+from flask_jwt_extended import create_access_token, jwt_required, current_user
 auth_bp = Blueprint('auth', __name__)
 @auth_bp.route('/signup', methods=['POST'])
 def signup():
@@ -38,7 +36,7 @@ def google_login():
     token = data.get('id_token')
     try:
         print("Received id_token:", token[:20] + "...") # Partial log for security
-        idinfo = google_id_token.verify_oauth2_token(token, google_requests.Request(), Config.GOOGLE_CLIENT_ID)
+        idinfo = google_certs.verify(token)
         print("Verified token info:", idinfo) # Full info for debug
         if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
             raise ValueError('Wrong issuer.')
@@ -63,8 +61,7 @@ def logout():
 @auth_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_user
     if user:
         return jsonify({'user': user.to_dict()}), 200
     return jsonify({'error': 'Not logged in'}), 401
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# Lyria realtime always streams 48 kHz stereo 16-bit PCM
+CHANNELS = 2
+OUTPUT_RATE = 48_000
+SAMPLE_WIDTH_BYTES = 2
+FRAME_RATE = OUTPUT_RATE
+BYTES_PER_SECOND = CHANNELS * SAMPLE_WIDTH_BYTES * OUTPUT_RATE
+# Playback constants - from Google demo
+BUFFER_SECONDS = 1
+CHUNK = 4200
+
+
+class AudioSink(ABC):
+    """Destination for the raw PCM chunks a Lyria session streams back.
+
+    `buffer_seconds` is how long the receive loop should wait before handing over the
+    first chunk (only useful for real-time playback), and `full` tells it when the
+    sink has captured everything it wants so the session can be stopped early.
+    Sinks that keep the audio also provide `save()` to persist it once the session ends.
+    """
+
+    buffer_seconds = 0
+
+    def open(self):
+        pass
+
+    @abstractmethod
+    def write(self, data):
+        pass
+
+    @property
+    def full(self):
+        return False
+
+    @property
+    def captured_bytes(self):
+        return 0
+
+    def close(self):
+        pass
+
+    def discard(self):
+        pass
+
+
+class SpeakerSink(AudioSink):
+    """Plays chunks through the local output device (CLI / MusicSessionController)."""
+
+    buffer_seconds = BUFFER_SECONDS
+
+    def __init__(self):
+        # Imported here so servers without PortAudio never load it
+        import pyaudio
+        self._pyaudio = pyaudio
+        self.pa = pyaudio.PyAudio()
+        self.stream = None
+
+    def open(self):
+        self.stream = self.pa.open(
+            format=self._pyaudio.paInt16,
+            channels=CHANNELS,
+            rate=OUTPUT_RATE,
+            output=True,
+            frames_per_buffer=CHUNK,
+        )
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def terminate(self):
+        self.close()
+        self.pa.terminate()
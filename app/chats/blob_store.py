@@ -0,0 +1,330 @@
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from flask import has_app_context
+
+from .storage import BASE_DIR, DOWNLOAD_DIR
+from .jobs import job_tracker, GENERATION_STATUSES
+from .live_streams import live_streams
+
+logger = logging.getLogger(__name__)
+
+BLOB_BACKEND_LOCAL = "local"
+BLOB_BACKEND_S3 = "s3"
+CHUNK_SIZE = 1024 * 1024
+# Only the stems themselves are shared; decoded .f32.npy copies are rebuilt per node
+SHARED_STEM_SUFFIX = ".mp3"
+
+
+class BlobNotFound(FileNotFoundError):
+    pass
+
+
+def blob_key(path):
+    """Key of a working-directory file: its path relative to where the API runs, with forward slashes."""
+    return Path(os.path.abspath(path)).relative_to(BASE_DIR).as_posix()
+
+
+class LocalBlobStore:
+    """Blobs kept as plain files under `root`.
+
+    With the default root (the API's working directory) a key names the working file
+    itself, so storing a freshly written clip or stem is a no-op. Any other root, such as
+    a mount shared by several nodes, is treated like a remote store.
+    """
+
+    def __init__(self, root=BASE_DIR):
+        self.root = Path(root)
+        self.remote = self.root.resolve() != BASE_DIR.resolve()
+
+    def _path(self, key):
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Blob key {key!r} is outside the store")
+        return path
+
+    def put(self, key, fileobj):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f, CHUNK_SIZE)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def put_file(self, key, source):
+        path = self._path(key)
+        if path.exists() and os.path.samefile(path, source):
+            return
+        with open(source, "rb") as f:
+            self.put(key, f)
+
+    def get_file(self, key, destination):
+        path = self._path(key)
+        if not path.exists():
+            raise BlobNotFound(key)
+        if os.path.abspath(destination) != str(path):
+            Path(destination).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, destination)
+
+    def stream(self, key, start=0, end=None):
+        """Yield the bytes of `key` from `start` up to and including `end`."""
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        with f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def exists(self, key):
+        return self._path(key).is_file()
+
+    def size(self, key):
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def url(self, key, expires_in, filename=None):
+        # Local blobs are served by the API itself
+        return None
+
+
+class S3BlobStore:
+    """Blobs in an S3 bucket (or anything speaking its API, e.g. MinIO via `endpoint_url`).
+
+    Keys mirror the working-directory layout under an optional prefix. Uploads are
+    multipart and streamed from the file; downloads go to a temporary file first.
+    """
+
+    remote = True
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("BLOB_STORE=s3 needs boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("BLOB_STORE=s3 needs BLOB_STORE_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        # Path-style addressing is what self-hosted S3 stand-ins expect
+        config = Config(signature_version="s3v4", s3={"addressing_style": "path" if endpoint_url else "auto"})
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region, config=config)
+        self._client_error = ClientError
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _missing(self, e):
+        return e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, self._key(key))
+
+    def put_file(self, key, source):
+        self.client.upload_file(str(source), self.bucket, self._key(key))
+
+    def get_file(self, key, destination):
+        Path(destination).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.client.download_file(self.bucket, self._key(key), temp_path)
+            os.replace(temp_path, destination)
+        except self._client_error as e:
+            if self._missing(e):
+                raise BlobNotFound(key)
+            raise
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def stream(self, key, start=0, end=None):
+        """Yield the bytes of `key` from `start` up to and including `end`."""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key),
+                                              Range=f"bytes={start}-{'' if end is None else end}")
+        except self._client_error as e:
+            if self._missing(e):
+                raise BlobNotFound(key)
+            raise
+        yield from response["Body"].iter_chunks(CHUNK_SIZE)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self._client_error as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))["ContentLength"]
+        except self._client_error as e:
+            if self._missing(e):
+                raise BlobNotFound(key)
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_prefix(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix.rstrip("/") + "/")):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+    def url(self, key, expires_in, filename=None):
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+
+class BlobStore:
+    """Where clips and stems are kept so any API node or separation worker can use them.
+
+    The working directory stays the place files are written and read from; the store
+    holds the shared copy. Finished clips and stems are uploaded once, and a node that
+    doesn't have a file locally fetches it (or hands the browser a direct download URL).
+    """
+
+    def __init__(self):
+        self.backend = LocalBlobStore()
+        self.url_expiry = 3600
+        self.redirect_downloads = True
+        self._lock = threading.Lock()
+        self._uploads = 0
+        self._downloads = 0
+        self._failures = 0
+
+    def init_app(self, app):
+        backend = app.config.get("BLOB_STORE", BLOB_BACKEND_LOCAL)
+        if backend == BLOB_BACKEND_S3:
+            self.backend = S3BlobStore(
+                app.config.get("BLOB_STORE_BUCKET"),
+                prefix=app.config.get("BLOB_STORE_PREFIX") or "",
+                endpoint_url=app.config.get("BLOB_STORE_ENDPOINT_URL"),
+                region=app.config.get("BLOB_STORE_REGION"),
+            )
+        elif backend == BLOB_BACKEND_LOCAL:
+            self.backend = LocalBlobStore(app.config.get("BLOB_STORE_ROOT") or BASE_DIR)
+        else:
+            raise RuntimeError(f"Unknown BLOB_STORE {backend!r}")
+        self.url_expiry = app.config.get("BLOB_STORE_URL_EXPIRY_SECONDS", self.url_expiry)
+        self.redirect_downloads = app.config.get("BLOB_STORE_REDIRECT_DOWNLOADS", self.redirect_downloads)
+        app.extensions["blob_store"] = self
+        logger.info(f"Blob store: {type(self.backend).__name__}")
+
+    @property
+    def remote(self):
+        return self.backend.remote
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def upload(self, path):
+        try:
+            self.backend.put_file(blob_key(path), path)
+        except Exception:
+            self._count("_failures")
+            raise
+        if self.remote:
+            self._count("_uploads")
+            logger.debug(f"Uploaded {path}")
+
+    def upload_stems(self, stem_dir):
+        for path in sorted(Path(stem_dir).glob(f"*{SHARED_STEM_SUFFIX}")):
+            self.upload(path)
+
+    def _generating(self, path):
+        # Clip files (<shard>/<link>.wav, .flac, ...) of a clip that is still being rendered can't be in the store yet
+        path = Path(os.path.abspath(path))
+        if path.parent.parent.parent != DOWNLOAD_DIR.resolve():
+            return False
+        link = path.name.split(".", 1)[0]
+        if live_streams.get(link) is not None:
+            return True
+        return has_app_context() and job_tracker.is_active(link, GENERATION_STATUSES)
+
+    def fetch(self, path):
+        """Make sure `path` exists locally, downloading it from the store if needed; False when it's nowhere."""
+        if os.path.exists(path):
+            return True
+        if not self.remote or self._generating(path):
+            return False
+        try:
+            self.backend.get_file(blob_key(path), path)
+        except BlobNotFound:
+            return False
+        except Exception as e:
+            self._count("_failures")
+            logger.error(f"Failed to fetch {path} from the blob store: {e}")
+            return False
+        self._count("_downloads")
+        logger.info(f"Fetched {path} from the blob store")
+        return True
+
+    def download_url(self, path, filename=None):
+        """A direct URL for a file this node doesn't have, or None when the API should serve it."""
+        if not self.remote or not self.redirect_downloads or self._generating(path):
+            return None
+        key = blob_key(path)
+        if not self.backend.exists(key):
+            return None
+        return self.backend.url(key, self.url_expiry, filename)
+
+    def remove(self, path):
+        if self.remote:
+            self.backend.delete(blob_key(path))
+
+    def remove_dir(self, directory):
+        if self.remote:
+            self.backend.delete_prefix(blob_key(directory))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "redirect_downloads": self.remote and self.redirect_downloads,
+                "uploads": self._uploads,
+                "downloads": self._downloads,
+                "failures": self._failures,
+            }
+
+
+blob_store = BlobStore()
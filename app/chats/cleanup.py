@@ -0,0 +1,117 @@
+import glob
+import logging
+import os
+import queue
+import shutil
+import threading
+
+from .storage import SEPARATED_DIR, clip_path, stem_dir
+from .mix_cache import mix_cache
+from .blob_store import blob_store
+from .clip_encoder import ENCODED_SUFFIXES
+from .waveforms import PEAKS_SUFFIX
+from .wav_writer import PARTIAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+
+def remove_clip_files(link, shared=True):
+    """Remove the clip, its encoded copies and peaks, its stems and its mixes, here and (unless `shared=False`) in the blob store.
+
+    Returns the number of local files and directories removed.
+    """
+    removed = 0
+    paths = [clip_path(link)] + [clip_path(link, suffix) for suffix in (*ENCODED_SUFFIXES, PEAKS_SUFFIX)]
+    if shared:
+        for path in paths:
+            blob_store.remove(path)
+    clip = clip_path(link)
+    partials = clip.parent.glob(f"{glob.escape(clip.name)}*{PARTIAL_SUFFIX}")
+    for path in paths + list(partials):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed + remove_stem_files(link, shared)
+
+
+def remove_stem_files(link, shared=True):
+    """Remove the clip's stems (with their decoded copies) and the mixes rendered from them.
+
+    With `shared=False` only this node's copies go and the blob store keeps the stems.
+    """
+    removed = 0
+    if shared:
+        blob_store.remove_dir(stem_dir(link))
+    try:
+        os.remove(SEPARATED_DIR / f"{link}_mixed.wav")  # mixes rendered before the mix cache existed
+        removed += 1
+    except FileNotFoundError:
+        pass
+    stems = stem_dir(link)
+    for path in (stems, stems.with_name(f"{link}.tmp")):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    removed += mix_cache.remove_track(link)
+    return removed
+
+
+class FileCleanupQueue:
+    """Removes the files of deleted clips on a background thread.
+
+    Deleting rows is a few indexed DELETEs; removing a clip's WAV, stem directory and
+    cached mixes is filesystem work the HTTP response shouldn't wait for.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._removed = 0
+        self._failed = 0
+
+    def init_app(self, app):
+        app.extensions["file_cleanup"] = self
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="file-cleanup", daemon=True)
+                self._worker.start()
+
+    def enqueue(self, links):
+        links = list(links)
+        if not links:
+            return
+        self._start()
+        for link in links:
+            self._queue.put(link)
+        logger.debug(f"Queued file cleanup for {len(links)} clips")
+
+    def _run(self):
+        while True:
+            link = self._queue.get()
+            try:
+                removed = remove_clip_files(link)
+                with self._lock:
+                    self._removed += removed
+                logger.info(f"Removed {removed} files for deleted clip {link}")
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error(f"Failed to remove files for {link}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        # Wait until everything queued so far is gone (shutdown, scripts)
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._queue.qsize(), "removed": self._removed, "failed": self._failed}
+
+
+file_cleanup = FileCleanupQueue()
@@ -0,0 +1,196 @@
+import logging
+import os
+import queue
+import subprocess
+import threading
+from collections import namedtuple
+
+from .blob_store import blob_store
+from .mixer import FFMPEG
+from .storage import clip_path
+
+logger = logging.getLogger(__name__)
+
+ClipFormat = namedtuple("ClipFormat", "name suffix mimetype codec_args")
+# WAV is the clip as generated; every other format is encoded from it with ffmpeg
+CLIP_FORMATS = {
+    "wav": ClipFormat("wav", ".wav", "audio/wav", None),
+    "flac": ClipFormat("flac", ".flac", "audio/flac", ["-c:a", "flac", "-compression_level", "8", "-f", "flac"]),
+    "opus": ClipFormat("opus", ".opus", "audio/ogg", ["-c:a", "libopus", "-b:a", "96k", "-f", "ogg"]),
+    "aac": ClipFormat("aac", ".m4a", "audio/mp4", ["-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", "-f", "mp4"]),
+    "mp3": ClipFormat("mp3", ".mp3", "audio/mpeg", ["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"]),
+}
+ENCODED_SUFFIXES = tuple(fmt.suffix for fmt in CLIP_FORMATS.values() if fmt.codec_args)
+# Accept header media types (and common aliases) per format
+MIMETYPE_FORMATS = {
+    "audio/wav": "wav", "audio/wave": "wav", "audio/x-wav": "wav",
+    "audio/flac": "flac", "audio/x-flac": "flac",
+    "audio/ogg": "opus", "audio/opus": "opus",
+    "audio/mp4": "aac", "audio/aac": "aac", "audio/x-m4a": "aac",
+    "audio/mpeg": "mp3", "audio/mp3": "mp3",
+}
+
+
+class ClipEncodeError(Exception):
+    pass
+
+
+def negotiate_format(requested, accept):
+    """Pick a clip format: `?format=` wins, then the first audio type the Accept header names explicitly.
+
+    Wildcards don't count, so clients that don't ask for anything keep getting WAV.
+    Returns None for an unknown `requested` format.
+    """
+    if requested:
+        return requested.lower() if requested.lower() in CLIP_FORMATS else None
+    for mimetype, _ in accept:
+        name = MIMETYPE_FORMATS.get(mimetype.split(";")[0].strip().lower())
+        if name:
+            return name
+    return "wav"
+
+
+def transcode(source, target, fmt):
+    """Encode the WAV at `source` into `target` in format `fmt`, replacing it atomically."""
+    temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    command = [FFMPEG, "-nostdin", "-v", "error", "-y", "-i", str(source), *CLIP_FORMATS[fmt].codec_args, temp_path]
+    try:
+        result = subprocess.run(command, capture_output=True)
+    except OSError as e:
+        # ffmpeg missing or not executable; not the same thing as a missing clip
+        raise ClipEncodeError(f"Could not run {FFMPEG} to encode {source} as {fmt}: {e}")
+    if result.returncode != 0:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise ClipEncodeError(f"Could not encode {source} as {fmt}: {result.stderr.decode(errors='replace').strip()}")
+    os.replace(temp_path, target)
+
+
+class ClipEncoder:
+    """Compressed copies of saved clips, next to the WAV as `<clip>.flac`, `<clip>.opus`, ...
+
+    The formats in `stored_formats` are encoded on a background thread right after a clip
+    is saved and go to the blob store with it. Any other format is transcoded on the same
+    thread the first time it's asked for and kept as a cached file. An encoded copy older
+    than its WAV (anonymous clips are re-rendered under the same name) is encoded again.
+    """
+
+    def __init__(self):
+        self.stored_formats = ("flac", "opus")
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._encoded = 0
+        self._transcoded = 0
+        self._failed = 0
+
+    def init_app(self, app):
+        formats = app.config.get("CLIP_STORED_FORMATS", self.stored_formats)
+        unknown = [name for name in formats if name not in CLIP_FORMATS]
+        if unknown:
+            raise RuntimeError(f"Unknown CLIP_STORED_FORMATS {', '.join(unknown)}")
+        self.stored_formats = tuple(name for name in formats if CLIP_FORMATS[name].codec_args)
+        app.extensions["clip_encoder"] = self
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="clip-encoder", daemon=True)
+                self._worker.start()
+
+    def enqueue(self, link, formats=None):
+        # Called once the clip is saved (and by requests for a format not encoded yet); keeps the
+        # encodes off the generation and request paths
+        formats = tuple(self.stored_formats if formats is None else formats)
+        if not formats:
+            return
+        with self._lock:
+            if (link, formats) in self._queued:
+                return
+            self._queued.add((link, formats))
+        self._start()
+        self._queue.put((link, formats))
+
+    def _run(self):
+        while True:
+            link, formats = self._queue.get()
+            try:
+                for name in formats:
+                    path, encoded = self._encode(link, name)
+                    if name in self.stored_formats:
+                        blob_store.upload(path)
+                    with self._lock:
+                        if name in self.stored_formats:
+                            self._encoded += 1
+                        elif encoded:
+                            self._transcoded += 1
+                logger.info(f"Encoded {link} as {', '.join(formats)}")
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error(f"Failed to encode {link}: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard((link, formats))
+                self._queue.task_done()
+
+    def _fresh(self, source, target):
+        try:
+            return os.stat(target).st_mtime_ns >= os.stat(source).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def _encode(self, link, name):
+        # Returns (path, whether it had to be encoded now)
+        source = clip_path(link)
+        target = clip_path(link, CLIP_FORMATS[name].suffix)
+        if self._fresh(source, target):
+            return target, False
+        transcode(source, target, name)
+        return target, True
+
+    def path_for(self, link, name, wait=True):
+        """Local path of `link` in format `name`, encoding it now if no up-to-date copy exists.
+
+        With `wait=False` a missing copy is queued for the background thread instead and
+        None is returned. Raises FileNotFoundError when the clip itself doesn't exist and
+        ClipEncodeError when encoding it fails.
+        """
+        if not CLIP_FORMATS[name].codec_args:
+            return clip_path(link)
+        source = clip_path(link)
+        target = clip_path(link, CLIP_FORMATS[name].suffix)
+        # Encoded on another node: its stored copy is as good as a local one
+        if not os.path.exists(source) and blob_store.fetch(target):
+            return target
+        if not blob_store.fetch(source):
+            raise FileNotFoundError(source)
+        if not wait:
+            if blob_store.fetch(target) and self._fresh(source, target):
+                return target
+            self.enqueue(link, (name,))
+            return None
+        target, encoded = self._encode(link, name)
+        if encoded:
+            with self._lock:
+                self._transcoded += 1
+        return target
+
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stored_formats": list(self.stored_formats),
+                "pending": self._queue.qsize(),
+                "encoded": self._encoded,
+                "transcoded": self._transcoded,
+                "failed": self._failed,
+            }
+
+
+clip_encoder = ClipEncoder()
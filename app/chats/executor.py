@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import math
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rough length of one Lyria session (30 s of audio plus connect/save overhead),
+# used for the Retry-After hint until we have measured a few real jobs.
+DEFAULT_JOB_SECONDS = 35
+# A pool of worker threads, each running one generation in its own event loop, or one
+# event loop running every generation as a task
+MODE_THREADS = "threads"
+MODE_ASYNCIO = "asyncio"
+
+
+class GenerationQueueFull(Exception):
+    """Raised by GenerationExecutor.submit when the pending queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class GenerationExecutor:
+    """Runs generation jobs (coroutine functions) with bounded concurrency and a bounded queue.
+
+    Every /talk request used to start its own thread (and its own Lyria session),
+    so a burst of prompts meant an unbounded number of threads and event loops.
+    Here at most `max_workers` generations run at once, at most `max_pending`
+    wait behind them, and anything beyond that is rejected so the route can
+    answer 503 with a Retry-After hint instead of piling up work.
+
+    In the default "threads" mode each worker thread runs its job with `asyncio.run`.
+    In "asyncio" mode all jobs are tasks on one long-lived event loop: the ASGI server's
+    (see asgi.py) or, under a WSGI server, a single loop thread. A session then costs a
+    coroutine rather than a thread, so `max_workers` can be much higher.
+    """
+
+    def __init__(self, max_workers=4, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.mode = MODE_THREADS
+        self._queue = None
+        self._workers = []
+        self._loop = None
+        self._slots = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._avg_job_seconds = DEFAULT_JOB_SECONDS
+
+    def init_app(self, app):
+        self.max_workers = app.config.get("GENERATION_MAX_WORKERS", self.max_workers)
+        self.max_pending = app.config.get("GENERATION_MAX_PENDING", self.max_pending)
+        self.mode = app.config.get("GENERATION_EXECUTOR", self.mode)
+        if self.mode not in (MODE_THREADS, MODE_ASYNCIO):
+            raise RuntimeError(f"Unknown GENERATION_EXECUTOR {self.mode!r}")
+        app.extensions["generation_executor"] = self
+
+    def attach_loop(self, loop):
+        """Run jobs on `loop`, the ASGI server's, instead of a loop thread of our own."""
+        with self._lock:
+            self.mode = MODE_ASYNCIO
+            self._loop = loop
+
+    def _start(self):
+        # Workers are started lazily so importing the app (flask db upgrade, shells)
+        # doesn't spin up threads.
+        with self._lock:
+            if self.mode == MODE_ASYNCIO:
+                if self._loop is None:
+                    self._loop = asyncio.new_event_loop()
+                    threading.Thread(target=self._loop.run_forever, name="generation-loop", daemon=True).start()
+                    logger.info(f"Generation executor running up to {self.max_workers} sessions on one event loop")
+                return
+            if self._queue is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._run, name=f"generation-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            logger.info(f"Generation executor started with {self.max_workers} workers, {self.max_pending} pending slots")
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue `fn(*args, **kwargs)`, a coroutine function; raises GenerationQueueFull when no slot is free."""
+        self._start()
+        if self.mode == MODE_ASYNCIO:
+            with self._lock:
+                full = self._pending >= self.max_pending
+                if not full:
+                    self._pending += 1
+            if not full:
+                # Hands the job to the loop without blocking on it or starting a thread
+                asyncio.run_coroutine_threadsafe(self._run_task(fn, args, kwargs), self._loop)
+        else:
+            try:
+                self._queue.put_nowait((fn, args, kwargs))
+                full = False
+            except queue.Full:
+                full = True
+        if full:
+            with self._lock:
+                self._rejected += 1
+            retry_after = self.retry_after()
+            logger.warning(f"Generation queue full ({self.max_pending} pending), rejecting job; retry after {retry_after}s")
+            raise GenerationQueueFull(retry_after)
+        logger.debug(f"Queued generation job, pending: {self.pending()}")
+
+    def pending(self):
+        if self.mode == MODE_ASYNCIO:
+            return self._pending
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def is_full(self):
+        return self.pending() >= self.max_pending
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                asyncio.run(self._track(fn(*args, **kwargs)))
+            finally:
+                self._queue.task_done()
+
+    async def _run_task(self, fn, args, kwargs):
+        if self._slots is None:
+            # Created on the loop it belongs to
+            self._slots = asyncio.Semaphore(self.max_workers)
+        async with self._slots:
+            with self._lock:
+                self._pending -= 1
+            await self._track(fn(*args, **kwargs))
+
+    async def _track(self, job):
+        with self._lock:
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            await job
+            with self._lock:
+                self._completed += 1
+        except Exception as e:
+            logger.error(f"Generation job failed: {e}")
+            with self._lock:
+                self._failed += 1
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                # Exponential moving average so the hint follows real job length
+                self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * elapsed
+
+    def retry_after(self):
+        # A pending slot frees up whenever any running job finishes, so with staggered
+        # jobs that is roughly one job length divided by the number of workers.
+        return max(1, math.ceil(self._avg_job_seconds / max(1, self.max_workers)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending(),
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_job_seconds": round(self._avg_job_seconds, 2),
+            }
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from .. import db
+from ..models import CachedClips
+from .storage import DOWNLOAD_DIR, clip_path, stem_dir
+from .stem_manifests import stem_manifests
+from .blob_store import blob_store
+
+logger = logging.getLogger(__name__)
+
+CACHE_POLICY_FRESH = "fresh"  # never reuse, every request renders a new clip
+CACHE_POLICY_TTL = "ttl"  # anyone reuses a clip rendered within the last N hours
+CACHE_POLICY_ANONYMOUS = "anonymous"  # only users who aren't logged in reuse clips
+CACHE_POLICIES = {CACHE_POLICY_FRESH, CACHE_POLICY_TTL, CACHE_POLICY_ANONYMOUS}
+CACHE_DIR = DOWNLOAD_DIR / "cache"
+STEM_NAMES = ['drums', 'bass', 'other', 'vocals']
+
+
+def fingerprint(prompt, bpm, key):
+    # Case and whitespace don't change what Lyria renders, so they don't split the cache
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256(f"{normalized}|{bpm}|{key}".encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src, dst):
+    # Hard links cost no extra disk; fall back to a copy across filesystems
+    tmp = f"{dst}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class GenerationCache:
+    """Maps a normalized (prompt, bpm, key) fingerprint to a clip that was already rendered.
+
+    The cache keeps its own hard link of every clip under MusicDownloadFiles/cache, so
+    deleting the chat that first produced it doesn't break later hits. Entries are
+    evicted least-recently-used first once the entry or byte budget is exceeded.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.policy = CACHE_POLICY_FRESH
+        self.ttl = timedelta(hours=24)
+        self.max_entries = 500
+        self.max_bytes = 2 * 1024 ** 3
+
+    def init_app(self, app):
+        self.app = app
+        self.policy = app.config.get("GENERATION_CACHE_POLICY", self.policy)
+        if self.policy not in CACHE_POLICIES:
+            logger.warning(f"Unknown GENERATION_CACHE_POLICY {self.policy!r}, caching disabled")
+            self.policy = CACHE_POLICY_FRESH
+        self.ttl = timedelta(hours=app.config.get("GENERATION_CACHE_TTL_HOURS", 24))
+        self.max_entries = app.config.get("GENERATION_CACHE_MAX_ENTRIES", self.max_entries)
+        self.max_bytes = app.config.get("GENERATION_CACHE_MAX_BYTES", self.max_bytes)
+        app.extensions["generation_cache"] = self
+
+    @property
+    def enabled(self):
+        return self.policy != CACHE_POLICY_FRESH
+
+    def reusable_for(self, anonymous):
+        return self.policy == CACHE_POLICY_TTL or (self.policy == CACHE_POLICY_ANONYMOUS and anonymous)
+
+    def lookup(self, fp, anonymous):
+        # Returns a live entry and bumps its LRU position; the caller's commit persists that
+        if not self.reusable_for(anonymous):
+            return None
+        entry = db.session.get(CachedClips, fp)
+        if entry is None:
+            return None
+        if entry.created < datetime.utcnow() - self.ttl or not (CACHE_DIR / f"{fp}.wav").exists():
+            return None
+        entry.hits += 1
+        entry.last_used = datetime.utcnow()
+        logger.info(f"Generation cache hit for {fp[:12]} (source {entry.source_link}, {entry.hits} hits)")
+        return entry
+
+    def materialize(self, entry, clip_name):
+        """Put the cached clip (and its stems, when the source has them) under `clip_name`.
+
+        Returns True when complete stems were linked as well.
+        """
+        target = clip_path(clip_name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(CACHE_DIR / f"{entry.fingerprint}.wav", target)
+        blob_store.upload(target)
+        manifest = stem_manifests.get(entry.source_link)
+        if manifest is None:
+            return False
+        if entry.source_link == clip_name:
+            # An anonymous prompt asked again: its link comes from the fingerprint, so the stems are already in place
+            return True
+        source_stems = stem_dir(entry.source_link, manifest.model)
+        target_stems = stem_dir(clip_name, manifest.model)
+        try:
+            target_stems.mkdir(parents=True, exist_ok=True)
+            for stem in manifest.names:
+                link_or_copy(source_stems / f"{stem}.mp3", target_stems / f"{stem}.mp3")
+        except FileNotFoundError:
+            # The source's stems were deleted since, or live on another node; separate this clip from scratch
+            return False
+        blob_store.upload_stems(target_stems)
+        stem_manifests.record(clip_name, manifest.model, manifest.stems)
+        return True
+
+    def store(self, fp, clip_path, prompt, bpm, key):
+        # Called by the generation worker once a fresh clip has been saved
+        if not self.enabled:
+            return
+        with self.app.app_context():
+            try:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                link_or_copy(clip_path, CACHE_DIR / f"{fp}.wav")
+                entry = db.session.get(CachedClips, fp)
+                if entry is None:
+                    entry = CachedClips(fingerprint=fp)
+                    db.session.add(entry)
+                entry.source_link = clip_path.stem
+                entry.prompt = prompt
+                entry.bpm = bpm
+                entry.key = str(key) if key is not None else None
+                entry.size = os.path.getsize(clip_path)
+                entry.hits = 0
+                entry.created = entry.last_used = datetime.utcnow()
+                db.session.commit()
+                logger.info(f"Cached {clip_path.name} as {fp[:12]}")
+                self.evict()
+            except Exception as e:
+                logger.error(f"Failed to cache {clip_path}: {e}")
+                db.session.rollback()
+
+    def evict(self):
+        expired_before = datetime.utcnow() - self.ttl
+        entries = CachedClips.query.order_by(CachedClips.last_used.desc()).all()
+        kept_bytes = 0
+        kept = 0
+        for entry in entries:
+            if entry.created >= expired_before and kept < self.max_entries and kept_bytes + entry.size <= self.max_bytes:
+                kept += 1
+                kept_bytes += entry.size
+                continue
+            try:
+                os.remove(CACHE_DIR / f"{entry.fingerprint}.wav")
+            except FileNotFoundError:
+                pass
+            db.session.delete(entry)
+            logger.debug(f"Evicted cached clip {entry.fingerprint[:12]}")
+        db.session.commit()
+
+    def stats(self):
+        entries = db.session.query(db.func.count(CachedClips.fingerprint), db.func.coalesce(db.func.sum(CachedClips.size), 0), db.func.coalesce(db.func.sum(CachedClips.hits), 0)).one()
+        return {
+            "policy": self.policy,
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            "entries": entries[0],
+            "bytes": int(entries[1]),
+            "hits": int(entries[2]),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify, make_response
+
+from .. import db
+from ..models import IdempotencyKeys
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def _expired_before():
+    return datetime.utcnow() - timedelta(hours=current_app.config.get("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+
+
+def find_previous(user_id, key):
+    """Return the stored result for (user_id, key), or None if the key is new or has expired."""
+    entry = IdempotencyKeys.query.filter_by(user_id=user_id, key=key).first()
+    if entry is None:
+        return None
+    if entry.created < _expired_before():
+        # Expired keys are reusable; the row is dropped in the same transaction as the new request's writes
+        db.session.delete(entry)
+        db.session.flush()
+        return None
+    return entry
+
+
+def remember(user_id, key, chat_id, message_id, new_chat):
+    # Added to the request's transaction, so the key is stored if and only if the rows it points at are
+    entry = IdempotencyKeys(user_id=user_id, key=key, chat=chat_id, message=message_id, new_chat=new_chat)
+    db.session.add(entry)
+    return entry
+
+
+def prune_expired():
+    """Delete every expired key in one statement (the retention pass calls this); returns how many went."""
+    try:
+        pruned = IdempotencyKeys.query.filter(IdempotencyKeys.created < _expired_before()).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return pruned
+
+
+def talk_response_body(chat_id, message_id, new_chat):
+    return {"new_chat": chat_id, "message": message_id} if new_chat else {"message": message_id}
+
+
+def replay_response(entry):
+    response = make_response(jsonify(talk_response_body(entry.chat, entry.message, entry.new_chat)), 200)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
@@ -0,0 +1,123 @@
+import json
+import logging
+import threading
+import time
+
+from .. import db
+from ..models import Jobs
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_GENERATING = "generating"
+JOB_SAVED = "saved"
+JOB_SEPARATING = "separating"
+JOB_STEMS_READY = "stems_ready"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = {JOB_STEMS_READY, JOB_FAILED}
+# A worker is still writing these jobs' files
+ACTIVE_JOB_STATUSES = (JOB_QUEUED, JOB_GENERATING, JOB_SEPARATING)
+# The clip itself doesn't exist yet
+GENERATION_STATUSES = (JOB_QUEUED, JOB_GENERATING)
+
+# How often a waiting listener re-reads the job from the database, so transitions made
+# by another API node or worker process are still picked up
+DB_POLL_SECONDS = 5
+HEARTBEAT_SECONDS = 15
+MAX_TRACKED_JOBS = 10_000
+
+
+class JobTracker:
+    """Persists job transitions in the `jobs` table and wakes up anyone waiting on them.
+
+    Worker threads and the separation watcher call `set_status()`; the status and
+    event-stream endpoints call `wait()` instead of probing the filesystem.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._cond = threading.Condition()
+        self._latest = {}
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["job_tracker"] = self
+
+    def create(self, link, audio_id=None):
+        # Called inside the request's transaction; anonymous re-submits reuse the same row
+        job = Jobs.query.filter_by(link=link).first()
+        if job is None:
+            job = Jobs(link=link, audio=audio_id)
+            db.session.add(job)
+        job.status = JOB_QUEUED
+        job.error = None
+        return job
+
+    def set_status(self, link, status, error=None):
+        with self.app.app_context():
+            try:
+                job = Jobs.query.filter_by(link=link).first()
+                if job is None:
+                    job = Jobs(link=link)
+                    db.session.add(job)
+                job.status = status
+                job.error = error
+                db.session.commit()
+                job_dict = job.to_dict()
+            except Exception as e:
+                logger.error(f"Failed to record status {status} for job {link}: {e}")
+                db.session.rollback()
+                return
+        logger.info(f"Job {link} -> {status}")
+        self._publish(link, job_dict)
+
+    def _publish(self, link, job_dict):
+        with self._cond:
+            self._latest.pop(link, None)
+            self._latest[link] = job_dict["status"]
+            while len(self._latest) > MAX_TRACKED_JOBS:
+                # Oldest transitions first; waiters on them fall back to polling the database
+                self._latest.pop(next(iter(self._latest)))
+            self._cond.notify_all()
+
+    def get(self, link):
+        job = Jobs.query.filter_by(link=link).first()
+        return job.to_dict() if job else None
+
+    def is_active(self, link, statuses=ACTIVE_JOB_STATUSES):
+        return db.session.query(Jobs.id).filter(Jobs.link == link, Jobs.status.in_(statuses)).first() is not None
+
+    def wait(self, link, since_status, timeout):
+        """Return the job once its status differs from `since_status`, or after `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(link)
+            # End the read transaction so a long wait doesn't pin a pooled connection
+            db.session.rollback()
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] != since_status or remaining <= 0:
+                return job
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._latest.get(link, since_status) != since_status,
+                    min(DB_POLL_SECONDS, remaining),
+                )
+
+    def events(self, link):
+        # Server-sent events: one `status` event per transition, heartbeats in between
+        status = None
+        while True:
+            job = self.wait(link, status, HEARTBEAT_SECONDS)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'message': 'Job not found'})}\n\n"
+                return
+            if job["status"] == status:
+                yield ": keep-alive\n\n"
+                continue
+            status = job["status"]
+            yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if status in TERMINAL_STATUSES:
+                return
+
+
+job_tracker = JobTracker()
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+
+from .wav_writer import WavFileSink, HEADER_SIZE, wav_header
+
+logger = logging.getLogger(__name__)
+
+# Data size advertised in the header of a progressive stream, the total length is unknown
+STREAMING_DATA_BYTES = 0xFFFFFFFF - 36
+READ_SIZE = 64 * 1024
+
+
+class LiveStream:
+    """Progress of one in-flight generation, shared by any number of listeners.
+
+    The audio itself is never buffered here: listeners read it from the `.part`
+    file the generation is writing, and only wait on this object to learn how many
+    bytes are safe to read and when the clip is finished.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.path = None
+        self.temp_path = None
+        self.data_bytes = 0
+        self.done = False
+        self._cond = threading.Condition()
+
+    def attach(self, path, temp_path):
+        with self._cond:
+            self.path = path
+            self.temp_path = temp_path
+            self._cond.notify_all()
+
+    def publish(self, data_bytes):
+        with self._cond:
+            self.data_bytes = data_bytes
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self, offset, timeout):
+        # Block until there is audio past `offset` or the stream ended; returns (available, done)
+        with self._cond:
+            self._cond.wait_for(lambda: self.data_bytes > offset or self.done, timeout)
+            return self.data_bytes, self.done
+
+    def open_reader(self, timeout):
+        # Waits for the generation to start writing, then opens whichever file currently holds the audio
+        with self._cond:
+            self._cond.wait_for(lambda: self.temp_path is not None or self.done, timeout)
+            paths = [self.temp_path, self.path]
+        for path in paths:
+            if path is None:
+                continue
+            try:
+                return open(path, "rb")
+            except FileNotFoundError:
+                continue
+        return None
+
+
+class LiveStreamRegistry:
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def open(self, key):
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = LiveStream(key)
+            return stream
+
+    def claim(self, key):
+        # Like open(), but None when the key already has a stream, i.e. a generation is in flight
+        with self._lock:
+            if key in self._streams:
+                return None
+            stream = self._streams[key] = LiveStream(key)
+            return stream
+
+    def get(self, key):
+        with self._lock:
+            return self._streams.get(key)
+
+    def close(self, key):
+        with self._lock:
+            stream = self._streams.pop(key, None)
+        if stream is not None:
+            stream.finish()
+
+
+live_streams = LiveStreamRegistry()
+
+
+class BroadcastWavSink(WavFileSink):
+    """WavFileSink that also lets listeners of `live_streams` follow the clip as it is written."""
+
+    def __init__(self, path, key, max_seconds=None):
+        super().__init__(path, max_seconds=max_seconds)
+        self.key = key
+        self.stream = live_streams.open(key)
+
+    def open(self):
+        super().open()
+        self.stream.attach(self.writer.path, self.writer.temp_path)
+
+    def write(self, data):
+        super().write(data)
+        self.stream.publish(self.writer.data_bytes)
+
+    def close(self):
+        super().close()
+        self.stream.finish()
+
+    def save(self, path=None):
+        try:
+            return super().save(path)
+        finally:
+            live_streams.close(self.key)
+
+    def discard(self):
+        super().discard()
+        live_streams.close(self.key)
+
+
+def stream_wav(stream, f, idle_seconds):
+    """Yield a WAV with a streaming header, followed by the audio of `stream` read from `f` as it arrives."""
+    try:
+        yield wav_header(STREAMING_DATA_BYTES)
+        f.seek(HEADER_SIZE)
+        offset = 0
+        last_data = time.monotonic()
+        while True:
+            available, done = stream.wait(offset, timeout=1)
+            if available > offset:
+                chunk = f.read(min(available - offset, READ_SIZE))
+                if chunk:
+                    offset += len(chunk)
+                    last_data = time.monotonic()
+                    yield chunk
+                    continue
+            if done and offset >= available:
+                break
+            if time.monotonic() - last_data > idle_seconds:
+                logger.warning(f"Live stream {stream.key} idle for {idle_seconds}s, closing")
+                break
+    finally:
+        f.close()
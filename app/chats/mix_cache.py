@@ -0,0 +1,209 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .mixer import MIX_CHANNELS
+from .storage import MIX_DIR, mix_dir
+
+logger = logging.getLogger(__name__)
+
+# Volumes are rounded to whole percent: finer steps aren't audible and would only split the cache
+GAIN_STEPS = 100
+# Volumes are clamped to 0-200%; louder stems would only clip
+MAX_GAIN = 2.0
+
+
+class InvalidGains(ValueError):
+    pass
+
+
+def quantize_gains(track_volumes, channels=MIX_CHANNELS):
+    """Map the request's trackVolumes onto whole-percent gains for `channels` (missing means 100%).
+
+    Volumes are clamped to 0..MAX_GAIN; raises InvalidGains for anything that isn't a finite number.
+    """
+    if not isinstance(track_volumes, dict):
+        raise InvalidGains("trackVolumes must be an object")
+    gains = {}
+    for channel in channels:
+        volume = track_volumes.get(channel, 1.0)
+        try:
+            if isinstance(volume, bool):
+                raise TypeError
+            volume = float(volume)
+        except (TypeError, ValueError):
+            raise InvalidGains(f"Volume of {channel} must be a number")
+        if not math.isfinite(volume):
+            raise InvalidGains(f"Volume of {channel} must be finite")
+        gains[channel] = round(min(max(volume, 0.0), MAX_GAIN) * GAIN_STEPS) / GAIN_STEPS
+    return gains
+
+
+class MixCache:
+    """Rendered mixes stored as one file per (track, quantized gains, format).
+
+    Files live under separated_music/mixes/<shard>/<track>/ and are named after their gains and
+    the stems' version, e.g. `drums100_bass0_other100.<version>.wav`. The least recently
+    served files are deleted once the directory grows past `max_bytes`.
+    """
+
+    def __init__(self):
+        self.directory = str(MIX_DIR)
+        self.max_bytes = 1024 ** 3
+        self._entries = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get("MIX_CACHE_MAX_BYTES", self.max_bytes)
+        app.extensions["mix_cache"] = self
+
+    def path_for(self, track, gains, fmt, version):
+        # `version` identifies the stems' content, so a re-separated track never matches an old mix
+        name = "_".join(f"{channel}{round(gain * GAIN_STEPS)}" for channel, gain in gains.items())
+        return str(mix_dir(track, self.directory) / f"{name}.{version}.{fmt}")
+
+    def _load_index(self):
+        # Called with the lock held; rebuilt from disk once per process, oldest access first
+        if self._entries is not None:
+            return
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_atime, path, st.st_size))
+        self._entries = OrderedDict((path, size) for _, path, size in sorted(found))
+        self._total_bytes = sum(self._entries.values())
+
+    def get(self, path):
+        """Open the mix at `path` for reading if it has already been rendered, else return None.
+
+        The open file keeps serving even if the mix is evicted before it has been sent.
+        """
+        try:
+            f = open(path, "rb")
+            st = os.fstat(f.fileno())
+        except FileNotFoundError:
+            f = st = None
+        with self._lock:
+            self._load_index()
+            if st is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries[path] = st.st_size
+            self._entries.move_to_end(path)
+        # Record the access on disk too so the LRU order survives restarts
+        try:
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except OSError:
+            pass
+        return f
+
+    def store(self, path, chunks):
+        """Write `chunks` to `path` atomically, account for it in the LRU and return it opened for reading."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        mix_file = None
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            # Opened before the rename so an eviction by a concurrent store can't pull it from under us
+            mix_file = open(temp_path, "rb")
+            os.replace(temp_path, path)
+        except BaseException:
+            if mix_file is not None:
+                mix_file.close()
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        size = os.fstat(mix_file.fileno()).st_size
+        with self._lock:
+            self._load_index()
+            self._total_bytes += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._evict()
+        return mix_file
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+                logger.debug(f"Evicted cached mix {path}")
+            except FileNotFoundError:
+                pass
+            try:
+                # Drop the track's directory once its last mix is gone
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def discard(self, path):
+        """Delete one cached mix; returns its size, or 0 when it was already gone."""
+        with self._lock:
+            self._load_index()
+            self._total_bytes -= self._entries.pop(path, 0)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+        return size
+
+    def remove_track(self, track):
+        """Delete every cached mix of `track`; returns the number of files removed."""
+        track_dir = str(mix_dir(track, self.directory))
+        removed = 0
+        with self._lock:
+            self._load_index()
+            for path in [path for path in self._entries if os.path.dirname(path) == track_dir]:
+                self._total_bytes -= self._entries.pop(path)
+        try:
+            names = os.listdir(track_dir)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            try:
+                os.remove(os.path.join(track_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(track_dir)
+        except OSError:
+            pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+
+mix_cache = MixCache()
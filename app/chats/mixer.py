@@ -0,0 +1,65 @@
+import logging
+import os
+import subprocess
+
+import numpy as np
+
+from .wav_writer import wav_header
+
+logger = logging.getLogger(__name__)
+
+# The instrumental mix: vocals are left out of the download
+MIX_CHANNELS = ['drums', 'bass', 'other']
+# htdemucs_ft writes stereo stems at 44.1 kHz
+MIX_SAMPLE_RATE = 44100
+MIX_CHANNEL_COUNT = 2
+MIX_SAMPLE_WIDTH = 2
+# Frames converted to int16 per chunk of the response body
+STREAM_CHUNK_FRAMES = 64 * 1024
+# Only used to decode MP3 stems, the mixing itself happens in NumPy
+FFMPEG = "ffmpeg"
+
+
+class StemDecodeError(Exception):
+    pass
+
+
+def decode_stem(path, sample_rate=MIX_SAMPLE_RATE, channels=MIX_CHANNEL_COUNT):
+    """Decode an audio file into a (frames, channels) float32 array through an ffmpeg pipe."""
+    command = [FFMPEG, "-nostdin", "-v", "error", "-i", str(path),
+               "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise StemDecodeError(f"Could not decode {path}: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype="<f4").reshape(-1, channels)
+
+
+def mix_stems(stems, gains):
+    """Sum `stems` (name -> float32 array) scaled by `gains` (name -> linear gain, 0 mutes).
+
+    Shorter stems are treated as silence past their end. Returns a float32 array.
+    """
+    frames = max(len(samples) for samples in stems.values())
+    mix = np.zeros((frames, MIX_CHANNEL_COUNT), dtype=np.float32)
+    for name, samples in stems.items():
+        gain = float(gains.get(name, 1.0))
+        if gain <= 0:
+            continue
+        if gain == 1.0:
+            mix[:len(samples)] += samples
+        else:
+            mix[:len(samples)] += samples * np.float32(gain)
+    return mix
+
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+
+
+def stream_wav_mix(mix):
+    # The length is known up front, so the header is written once with its final sizes
+    yield wav_header(mix.shape[0] * mix.shape[1] * MIX_SAMPLE_WIDTH, channels=mix.shape[1],
+                     sample_width=MIX_SAMPLE_WIDTH, frame_rate=MIX_SAMPLE_RATE)
+    for start in range(0, len(mix), STREAM_CHUNK_FRAMES):
+        yield to_pcm16(mix[start:start + STREAM_CHUNK_FRAMES]).tobytes()
+
@@ -0,0 +1,80 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidPageRequest(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [datetime.fromisoformat(v) if key.type.python_type is datetime else v for key, v in zip(keys, values)]
+    except (binascii.Error, ValueError, TypeError, NotImplementedError):
+        raise InvalidPageRequest("Invalid cursor")
+
+
+def page_args():
+    """Read ?limit=, ?cursor= and ?order=asc|desc, applying the configured page size bounds.
+
+    The limit is None (the whole listing, as before pagination) when neither ?limit= nor ?cursor= is given.
+    """
+    order = request.args.get("order", "asc")
+    if order not in ("asc", "desc"):
+        raise InvalidPageRequest("order must be asc or desc")
+    cursor = request.args.get("cursor")
+    if "limit" not in request.args and not cursor:
+        return None, None, order == "desc"
+    default_size = current_app.config.get("LIST_PAGE_SIZE", 50)
+    max_size = current_app.config.get("LIST_MAX_PAGE_SIZE", 200)
+    limit = request.args.get("limit", default_size, type=int)
+    if limit is None or limit < 1:
+        raise InvalidPageRequest("limit must be a positive integer")
+    return min(limit, max_size), cursor, order == "desc"
+
+
+def keyset_page(query, keys, limit, cursor=None, descending=False):
+    """Return (rows, next_cursor) for the page of `query` after `cursor`, ordered by `keys`.
+
+    `keys` must end in a unique column so the order is total; every row has to select
+    the key columns under their own names. Only the page (plus one row to know whether
+    another page follows) is fetched, however far into the listing the cursor is. A
+    `limit` of None returns every row.
+    """
+    if cursor:
+        values = decode_cursor(cursor, keys)
+        # (k1, k2, ...) > (v1, v2, ...) spelled out, so it works on every backend
+        clauses = []
+        for i, (key, value) in enumerate(zip(keys, values)):
+            step = key < value if descending else key > value
+            clauses.append(and_(*[k == v for k, v in zip(keys[:i], values[:i])], step))
+        query = query.filter(or_(*clauses))
+    query = query.order_by(*[key.desc() if descending else key.asc() for key in keys])
+    if limit is None:
+        return query.all(), None
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], key.key) for key in keys])
+
+
+def paged_response(response, next_cursor):
+    # The body stays a plain list for existing clients; the cursor for the next page travels in a header
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
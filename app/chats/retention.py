@@ -0,0 +1,434 @@
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, timedelta
+
+from .. import db
+from ..models import Audios, Chat, ClipMetadata, Jobs, StemManifest
+from .storage import DOWNLOAD_DIR, SEPARATED_DIR, DEMUCS_MODEL_NAME, iter_shards
+from .cleanup import remove_clip_files, remove_stem_files
+from .idempotency import prune_expired
+from .clip_encoder import ENCODED_SUFFIXES
+from .jobs import JOB_SAVED, JOB_STEMS_READY, JOB_FAILED, ACTIVE_JOB_STATUSES
+from .mix_cache import mix_cache
+from .blob_store import blob_store
+from .stem_cache import DECODED_SUFFIX
+from .waveforms import PEAKS_SUFFIX
+from .wav_writer import partial_target
+
+logger = logging.getLogger(__name__)
+
+# Clips rendered for users who aren't logged in (see post_chats)
+ANONYMOUS_PREFIX = "lyria_temp_"
+
+KIND_CLIP = "clip"
+KIND_ENCODED = "encoded"  # FLAC/Opus/... copy of a clip
+KIND_PEAKS = "peaks"  # waveform peaks of a clip
+KIND_PARTIAL = "partial"  # half-written clip or stem directory left behind by a crash
+KIND_STEMS = "stems"
+KIND_DECODED = "decoded"
+KIND_MIX = "mix"
+# Everything that can be rebuilt from the clip itself
+DERIVED_KINDS = (KIND_ENCODED, KIND_PEAKS, KIND_STEMS, KIND_DECODED, KIND_MIX)
+
+ACTION_LINK = "link"
+ACTION_STEMS = "stems"
+ACTION_FILE = "file"
+
+# Disk-pressure evictions; with a shared blob store they only drop this node's copies
+LOCAL_ONLY_REASONS = ("user_quota", "watermark")
+
+LEGACY_MIX_SUFFIX = "_mixed.wav"
+LOOKUP_CHUNK = 500
+
+Artifact = namedtuple("Artifact", "link kind path size accessed")
+
+
+def _scandir(path):
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+
+def _accessed(st):
+    # atime alone can't be trusted on relatime/noatime mounts; a write counts as an access too
+    return max(st.st_atime, st.st_mtime)
+
+
+def _usage(entries):
+    size, accessed = 0, 0
+    for entry in entries:
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        size += st.st_size
+        accessed = max(accessed, _accessed(st))
+    return size, accessed
+
+
+def scan_artifacts():
+    """List every clip, encoded copy, peaks file, stem directory, decoded stem and mix on disk, keyed by the clip's link."""
+    artifacts = []
+    # The generation cache (MusicDownloadFiles/cache) isn't a shard and manages its own size
+    for entry in (entry for shard_dir in iter_shards(DOWNLOAD_DIR) for entry in _scandir(shard_dir)):
+        if entry.name.endswith(".wav"):
+            link, kind = entry.name[:-len(".wav")], KIND_CLIP
+        elif (partial_target(entry.name) or "").endswith(".wav"):
+            link, kind = partial_target(entry.name)[:-len(".wav")], KIND_PARTIAL
+        elif entry.name.endswith(ENCODED_SUFFIXES):
+            link, kind = os.path.splitext(entry.name)[0], KIND_ENCODED
+        elif entry.name.endswith(PEAKS_SUFFIX):
+            link, kind = entry.name[:-len(PEAKS_SUFFIX)], KIND_PEAKS
+        else:
+            continue
+        size, accessed = _usage([entry])
+        artifacts.append(Artifact(link, kind, entry.path, size, accessed))
+
+    for stem_dir in (entry for shard_dir in iter_shards(SEPARATED_DIR) for entry in _scandir(shard_dir / DEMUCS_MODEL_NAME)):
+        if not stem_dir.is_dir():
+            continue
+        files = _scandir(stem_dir.path)
+        if stem_dir.name.endswith(".tmp"):
+            size, accessed = _usage(files)
+            artifacts.append(Artifact(stem_dir.name[:-len(".tmp")], KIND_PARTIAL, stem_dir.path, size, accessed))
+            continue
+        for entry in files:
+            if entry.name.endswith(DECODED_SUFFIX):
+                size, accessed = _usage([entry])
+                artifacts.append(Artifact(stem_dir.name, KIND_DECODED, entry.path, size, accessed))
+        size, accessed = _usage([entry for entry in files if not entry.name.endswith(DECODED_SUFFIX)])
+        artifacts.append(Artifact(stem_dir.name, KIND_STEMS, stem_dir.path, size, accessed))
+
+    for entry in _scandir(SEPARATED_DIR):
+        if entry.is_file() and entry.name.endswith(LEGACY_MIX_SUFFIX):
+            size, accessed = _usage([entry])
+            artifacts.append(Artifact(entry.name[:-len(LEGACY_MIX_SUFFIX)], KIND_MIX, entry.path, size, accessed))
+    for track_dir in (entry for shard_dir in iter_shards(mix_cache.directory) for entry in _scandir(shard_dir)):
+        if not track_dir.is_dir():
+            continue
+        for entry in _scandir(track_dir.path):
+            if not entry.name.endswith(".tmp"):
+                size, accessed = _usage([entry])
+                artifacts.append(Artifact(track_dir.name, KIND_MIX, entry.path, size, accessed))
+    return artifacts
+
+
+def _chunks(links):
+    # IN lists are bounded so this scales with the number of clips on disk
+    links = sorted(links)
+    for i in range(0, len(links), LOOKUP_CHUNK):
+        yield links[i:i + LOOKUP_CHUNK]
+
+
+def _lookup(links, query):
+    return [row for chunk in _chunks(links) for row in query(chunk).all()]
+
+
+def clip_owners(links):
+    """Map the links that have an Audios row to their owner's user id (None when chat-less)."""
+    return dict(_lookup(links, lambda chunk: db.session.query(Audios.link, Chat.user_id)
+                        .outerjoin(Chat, Chat.id == Audios.chat).filter(Audios.link.in_(chunk))))
+
+
+def _stale(stale_before):
+    # Active jobs that haven't moved since `stale_before` belong to a worker that died
+    return db.func.coalesce(Jobs.updated, Jobs.created) < stale_before
+
+
+def active_links(links, stale_before):
+    return {link for link, in _lookup(links, lambda chunk: db.session.query(Jobs.link)
+                                      .filter(Jobs.link.in_(chunk), Jobs.status.in_(ACTIVE_JOB_STATUSES),
+                                              db.not_(_stale(stale_before))))}
+
+
+def fail_stale_jobs(stale_before):
+    """Mark active jobs untouched since `stale_before` as failed, so their files can be collected."""
+    try:
+        failed = (Jobs.query.filter(Jobs.status.in_(ACTIVE_JOB_STATUSES), _stale(stale_before))
+                  .update({"status": JOB_FAILED, "error": "Timed out"}, synchronize_session=False))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if failed:
+        logger.warning(f"Marked {failed} stale jobs as failed")
+    return failed
+
+
+class RetentionPlan:
+    """What one GC pass will remove, worked out from a single scan before anything is touched."""
+
+    def __init__(self, artifacts):
+        self.by_link = defaultdict(list)
+        for artifact in artifacts:
+            self.by_link[artifact.link].append(artifact)
+        self.actions = []
+        self.removed = Counter()
+        self.freed = 0
+        self._gone = set()
+
+    def alive(self, artifacts):
+        return [artifact for artifact in artifacts if artifact not in self._gone]
+
+    def last_access(self, link):
+        return max((artifact.accessed for artifact in self.by_link[link]), default=0)
+
+    def _drop(self, artifacts, action, link, path, reason):
+        artifacts = self.alive(artifacts)
+        if not artifacts:
+            return 0
+        self._gone.update(artifacts)
+        size = sum(artifact.size for artifact in artifacts)
+        self.actions.append((action, link, path, reason, size))
+        self.removed[reason] += 1
+        self.freed += size
+        return size
+
+    def remove_link(self, link, reason):
+        """Everything of the clip, the clip itself included."""
+        return self._drop(self.by_link[link], ACTION_LINK, link, None, reason)
+
+    def remove(self, artifact, reason):
+        # Stems take their decoded copies and the mixes rendered from them along
+        if artifact.kind == KIND_STEMS:
+            derived = [a for a in self.by_link[artifact.link] if a.kind in (KIND_STEMS, KIND_DECODED, KIND_MIX)]
+            return self._drop(derived, ACTION_STEMS, artifact.link, None, reason)
+        return self._drop([artifact], ACTION_FILE, artifact.link, artifact.path, reason)
+
+
+class RetentionCollector:
+    """Background garbage collector for generated clips, stems and mixes.
+
+    Each pass scans MusicDownloadFiles and separated_music, reconciles what it finds
+    against the Audios table and applies, in order: the anonymous clip TTL, the mix TTL,
+    orphan removal (files whose link has no Audios row), the per-user quota and the global
+    high/low watermark. Quota and watermark evictions take the least recently accessed
+    artifacts first, and expired Idempotency-Key rows are deleted at the end of each pass.
+    Files of queued, generating or separating jobs are skipped, unless the job hasn't moved
+    for `stale_job_timeout`: those are failed and collected like any other. A registered user's clip is only ever removed by deleting its chat;
+    the quota evicts their stems and mixes, which are separated or rendered again on demand.
+    With a shared blob store, quota and watermark evictions only drop this node's copies.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.interval = 30 * 60
+        self.anonymous_ttl = 24 * 3600
+        self.mix_ttl = 168 * 3600
+        self.orphan_grace = 3600
+        self.stale_job_timeout = 6 * 3600
+        self.user_quota = 2 * 1024 ** 3
+        self.high_watermark = 20 * 1024 ** 3
+        self.low_watermark = 16 * 1024 ** 3
+        self.enabled = True
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pass_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._removed = Counter()
+        self._freed = 0
+        self._last = {}
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get("GC_INTERVAL_MINUTES", 30) * 60
+        self.anonymous_ttl = app.config.get("GC_ANONYMOUS_TTL_HOURS", 24) * 3600
+        self.mix_ttl = app.config.get("GC_MIX_TTL_HOURS", 168) * 3600
+        self.orphan_grace = app.config.get("GC_ORPHAN_GRACE_HOURS", 1) * 3600
+        self.stale_job_timeout = app.config.get("GC_STALE_JOB_HOURS", 6) * 3600
+        self.user_quota = app.config.get("GC_USER_QUOTA_BYTES", self.user_quota)
+        self.high_watermark = app.config.get("GC_HIGH_WATERMARK_BYTES", self.high_watermark)
+        self.low_watermark = min(app.config.get("GC_LOW_WATERMARK_BYTES", self.low_watermark), self.high_watermark)
+        self.enabled = app.config.get("RETENTION_ENABLED", True) and self.interval > 0
+        app.extensions["retention"] = self
+        if self.enabled:
+            # Started by the first request, so CLI commands and one-off scripts don't run passes
+            app.before_request(self._start)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="retention-gc", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.run_once()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}")
+
+    def run_once(self, dry_run=False):
+        """Run one pass inside an app context; returns the number of artifacts removed per policy."""
+        with self._pass_lock:
+            started = time.monotonic()
+            now = time.time()
+            artifacts = scan_artifacts()
+            links = {artifact.link for artifact in artifacts}
+            owners = clip_owners(links)
+            stale_before = datetime.utcnow() - timedelta(seconds=self.stale_job_timeout)
+            stale_jobs = 0 if dry_run else fail_stale_jobs(stale_before)
+            active = active_links(links, stale_before)
+            plan = RetentionPlan([artifact for artifact in artifacts if artifact.link not in active])
+            self._expire(plan, owners, now)
+            over_quota = self._enforce_quota(plan, owners)
+            usage = self._enforce_watermark(plan, owners)
+            expired_keys = 0
+            if not dry_run:
+                self._apply(plan)
+                expired_keys = prune_expired()
+            verb = "Would remove" if dry_run else "Removed"
+            logger.info(f"Retention pass: {verb.lower()} {sum(plan.removed.values())} artifacts "
+                        f"({plan.freed} bytes), {usage} bytes left, took {time.monotonic() - started:.1f}s")
+            for action, link, path, reason, size in plan.actions:
+                logger.debug(f"{verb} {action} {path or link} ({reason}, {size} bytes)")
+            with self._lock:
+                self._runs += 1
+                if not dry_run:
+                    self._removed.update(plan.removed)
+                    self._freed += plan.freed
+                self._last = {
+                    "at": datetime.utcnow().isoformat(),
+                    "dry_run": dry_run,
+                    "seconds": round(time.monotonic() - started, 3),
+                    "scanned": len(artifacts),
+                    "removed": dict(plan.removed),
+                    "freed_bytes": plan.freed,
+                    "usage_bytes": usage,
+                    "over_quota_users": over_quota,
+                    "stale_jobs": stale_jobs,
+                    "expired_idempotency_keys": expired_keys,
+                }
+            return dict(plan.removed)
+
+    def _expire(self, plan, owners, now):
+        for link in list(plan.by_link):
+            idle = now - plan.last_access(link)
+            if link.startswith(ANONYMOUS_PREFIX):
+                if idle > self.anonymous_ttl:
+                    plan.remove_link(link, "anonymous_ttl")
+            elif link not in owners and idle > self.orphan_grace:
+                plan.remove_link(link, "orphan")
+        for artifacts in plan.by_link.values():
+            for artifact in plan.alive(artifacts):
+                if artifact.kind == KIND_MIX and now - artifact.accessed > self.mix_ttl:
+                    plan.remove(artifact, "mix_ttl")
+                elif artifact.kind == KIND_PARTIAL and now - artifact.accessed > self.orphan_grace:
+                    plan.remove(artifact, "orphan")
+
+    def _enforce_quota(self, plan, owners):
+        if not self.user_quota:
+            return []
+        by_user = defaultdict(list)
+        for link, artifacts in plan.by_link.items():
+            if owners.get(link) is not None:
+                by_user[owners[link]].extend(plan.alive(artifacts))
+        over_quota = []
+        for user_id, artifacts in by_user.items():
+            usage = sum(artifact.size for artifact in artifacts)
+            derived = sorted((a for a in artifacts if a.kind in DERIVED_KINDS), key=lambda a: a.accessed)
+            for artifact in derived:
+                if usage <= self.user_quota:
+                    break
+                usage -= plan.remove(artifact, "user_quota")
+            if usage > self.user_quota:
+                over_quota.append(user_id)
+                logger.warning(f"User {user_id} keeps {usage} bytes of clips, over the {self.user_quota} byte quota")
+        return over_quota
+
+    def _enforce_watermark(self, plan, owners):
+        usage = sum(artifact.size for artifacts in plan.by_link.values() for artifact in plan.alive(artifacts))
+        if not self.high_watermark or usage <= self.high_watermark:
+            return usage
+        # Anonymous clips compete with derived files on last access. Registered clips are only
+        # evicted when the blob store keeps the original
+        candidates = []
+        for link, artifacts in plan.by_link.items():
+            if link.startswith(ANONYMOUS_PREFIX) or blob_store.remote:
+                candidates.append((plan.last_access(link), link, None))
+            candidates.extend((a.accessed, link, a) for a in plan.alive(artifacts) if a.kind in DERIVED_KINDS)
+        for _, link, artifact in sorted(candidates, key=lambda c: c[0]):
+            if usage <= self.low_watermark:
+                break
+            usage -= plan.remove_link(link, "watermark") if artifact is None else plan.remove(artifact, "watermark")
+        if usage > self.low_watermark:
+            logger.warning(f"Audio storage still at {usage} bytes after eviction, low watermark is {self.low_watermark}")
+        return usage
+
+    def _apply(self, plan):
+        shared = [(action, link) for action, link, _, reason, _ in plan.actions
+                  if not (blob_store.remote and reason in LOCAL_ONLY_REASONS)]
+        forgotten = [link for action, link in shared if action == ACTION_LINK]
+        unseparated = [link for action, link in shared if action == ACTION_STEMS]
+        # Rows go first, so nobody is pointed at stems that are about to disappear
+        try:
+            for chunk in _chunks(forgotten + unseparated):
+                StemManifest.query.filter(StemManifest.link.in_(chunk)).delete(synchronize_session=False)
+            for chunk in _chunks(forgotten):
+                Jobs.query.filter(Jobs.link.in_(chunk)).delete(synchronize_session=False)
+                ClipMetadata.query.filter(ClipMetadata.link.in_(chunk)).delete(synchronize_session=False)
+            for chunk in _chunks(unseparated):
+                Jobs.query.filter(Jobs.link.in_(chunk), Jobs.status == JOB_STEMS_READY).update(
+                    {"status": JOB_SAVED, "error": None}, synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for action, link, path, reason, _ in plan.actions:
+            local_only = blob_store.remote and reason in LOCAL_ONLY_REASONS
+            try:
+                if action == ACTION_LINK:
+                    remove_clip_files(link, shared=not local_only)
+                elif action == ACTION_STEMS:
+                    remove_stem_files(link, shared=not local_only)
+                elif path.startswith(os.path.join(mix_cache.directory, "")):
+                    mix_cache.discard(path)
+                elif os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to remove {path or link} ({reason}): {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "running": self._thread is not None,
+                "interval_minutes": self.interval / 60,
+                "user_quota_bytes": self.user_quota,
+                "high_watermark_bytes": self.high_watermark,
+                "low_watermark_bytes": self.low_watermark,
+                "runs": self._runs,
+                "removed": dict(self._removed),
+                "freed_bytes": self._freed,
+                "last_run": self._last,
+            }
+
+
+retention_collector = RetentionCollector()
+
+
+if __name__ == "__main__":
+    # python -m app.chats.retention [--dry-run]  (run from the directory the API runs in)
+    from app import create_app
+    from app.chats.retention import retention_collector
+
+    app = create_app()
+    with app.app_context():
+        removed = retention_collector.run_once(dry_run="--dry-run" in sys.argv[1:])
+    print(f"Removed: {removed or 'nothing'}")
+    sys.exit(0)
@@ -1,25 +1,40 @@
-from flask import Blueprint, jsonify, request, make_response, send_file, current_app, redirect, url_for, session, send_from_directory
-from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
-from ..models import Chat, Messages, Audios, User, delete_prompt_and_audio, delete_audio_files_for_prompt
-from .. import db, oauth
-from .lyria_demo_test2 import generate_audio
+from flask import Blueprint, jsonify, request, make_response, send_file, current_app, redirect, url_for, session, Response, stream_with_context
+from werkzeug.security import safe_join
+from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token, current_user
+from ..models import Chat, Messages, Audios, ClipMetadata, User, IdempotencyKeys, delete_prompt_and_audio, delete_chat_rows
+from .. import db, oauth, generation_executor
+from ..identity import identity_cache
+from .lyria_demo_test2 import generate_audio, start_demucs_separation_after_lyria
+from .storage import DEMUCS_MODEL_NAME, clip_path, stem_root, stem_dir
+from .blob_store import blob_store
+from .clip_encoder import clip_encoder, negotiate_format, ClipEncodeError, CLIP_FORMATS
+from .waveforms import waveform_peaks, read_peaks
+from .executor import GenerationQueueFull
+from .live_streams import live_streams, stream_wav
+from .jobs import job_tracker, JOB_GENERATING, JOB_SAVED, JOB_SEPARATING, JOB_STEMS_READY, JOB_FAILED
+from .generation_cache import generation_cache, fingerprint, STEM_NAMES
+from .separation import separation_scheduler, PRIORITY_ON_DEMAND
+from .mixer import mix_stems, stream_wav_mix, StemDecodeError, MIX_CHANNELS
+from .mix_cache import mix_cache, quantize_gains, InvalidGains
+from .stem_cache import stem_cache
+from .stem_manifests import stem_manifests
+from .cleanup import file_cleanup
+from .retention import retention_collector, ANONYMOUS_PREFIX
+from .pagination import page_args, keyset_page, paged_response, InvalidPageRequest
+from .idempotency import IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, find_previous, remember, replay_response, talk_response_body
+from sqlalchemy.exc import IntegrityError
 import asyncio
 import os
-import subprocess
 from pathlib import Path
-from threading import Thread
 from urllib.parse import unquote
-import math
 from dotenv import load_dotenv
 import base64
 import logging
 load_dotenv()
-usevenv = os.getenv("USEVENV")
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 routes_bp = Blueprint('routes', __name__)
-music_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'MusicDownloadFiles'))
 """
 Instructions to set up the environment (macOS)
 Create the environment for Demucs
@@ -31,34 +46,124 @@ conda install -c pytorch -c conda-forge demucs ffmpeg -y
 Deactivate it when you're done
 conda deactivate
 """
-if usevenv == "true":
-    CONDA_ENV_PATH = "/venv"
-else:
-    CONDA_ENV_PATH = "/opt/anaconda3/envs/demucs-env"
-# Folder Paths
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-SEPARATED_DIR = os.path.join(BASE_DIR, "separated_music")
-DEMUCS_MODEL_NAME = "htdemucs_ft" # The model used in separator.py
-# Ensure the output directory exists at startup
-os.makedirs(SEPARATED_DIR, exist_ok=True)
-# Use the absolute path to MusicDownloadFiles
-music_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'MusicDownloadFiles'))
-def commit(new_obj, action="add"):
-    if action == "add":
-        db.session.add(new_obj)
-        db.session.commit()
-    elif action == "delete":
-        db.session.delete(new_obj)
-        db.session.commit()
-def create_a_message_and_send_prompt(prompt, chat_id, data, prompt_id, app):
+# Clips, stems and mixes live in sharded directories, see storage.py
+# Progressive streaming: how long a listener waits for a queued generation to start, and
+# how long a running one may go without producing audio before the stream is closed
+LIVE_STREAM_WAIT_SECONDS = 15
+LIVE_STREAM_IDLE_SECONDS = 30
+JOB_LONG_POLL_MAX_SECONDS = 30
+CHAT_TITLE_LENGTH = 60
+# Browser caching of audio files: a saved clip never changes, stems can be re-separated
+CLIP_MAX_AGE_SECONDS = 365 * 24 * 3600
+STEM_MAX_AGE_SECONDS = 3600
+ENCODE_RETRY_AFTER_SECONDS = 30
+def chat_title(prompt):
+    # Named after its first prompt, cut at a word boundary to fit conversations.title
+    title = " ".join(prompt.split())
+    if len(title) <= CHAT_TITLE_LENGTH:
+        return title
+    return title[:CHAT_TITLE_LENGTH - 3].rsplit(" ", 1)[0] + "..."
+async def create_a_message_and_send_prompt(prompt, chat_id, data, prompt_id, app):
+    # Runs on the generation executor's event loop; database and file work goes to threads so
+    # other sessions sharing the loop keep streaming
     logger.debug(f"Starting create_a_message_and_send_prompt for prompt: {prompt}, chat_id: {chat_id}, prompt_id: {prompt_id}, data: {data}")
+    clip_name = f"lyria_{chat_id}_{prompt_id}"
     try:
-        logger.debug("Calling asyncio.run(generate_audio)")
-        asyncio.run(generate_audio(data["bpm"], data["key"], prompt, chat_id, prompt_id))
+        await asyncio.to_thread(job_tracker.set_status, clip_name, JOB_GENERATING)
+        await generate_audio(data["bpm"], data["key"], prompt, chat_id, prompt_id)
         logger.debug("generate_audio completed successfully")
+        await asyncio.to_thread(generation_cache.store, fingerprint(prompt, data["bpm"], data["key"]), clip_path(clip_name),
+                                prompt, data["bpm"], data["key"])
     except Exception as e:
         logger.error(f"Error in create_a_message_and_send_prompt during audio generation: {str(e)}")
+        # The sink closes the stream once it exists; failures before that (no API key, connect errors) must too
+        live_streams.close(clip_name)
+        await asyncio.to_thread(job_tracker.set_status, clip_name, JOB_FAILED, str(e))
+        raise
+def submit_generation(prompt, chat_id, data, prompt_id, app):
+    # Register the live stream before queueing so /stream-audio can attach while the job waits;
+    # an anonymous prompt already being generated here is only rendered once
+    clip_name = f"lyria_{chat_id}_{prompt_id}"
+    if live_streams.claim(clip_name) is None:
+        logger.info(f"Generation of {clip_name} already in progress")
+        return
+    try:
+        generation_executor.submit(create_a_message_and_send_prompt, prompt, chat_id, data, prompt_id, app)
+    except GenerationQueueFull:
+        live_streams.close(clip_name)
         raise
+def reuse_cached_clip(entry, chat_id, prompt_id):
+    # Cache hit: the clip (and its stems, if the source has them) are linked in place of a new Lyria session
+    clip_name = f"lyria_{chat_id}_{prompt_id}"
+    has_stems = generation_cache.materialize(entry, clip_name)
+    live_streams.close(clip_name)
+    job_tracker.set_status(clip_name, JOB_SAVED)
+    clip_encoder.enqueue(clip_name)
+    waveform_peaks.enqueue(clip_name)
+    if has_stems:
+        job_tracker.set_status(clip_name, JOB_STEMS_READY)
+        waveform_peaks.enqueue(clip_name, STEM_NAMES)
+    else:
+        start_demucs_separation_after_lyria(chat_id, prompt_id)
+def start_generation(prompt, chat_id, data, prompt_id, app, cached=None):
+    if cached is not None:
+        reuse_cached_clip(cached, chat_id, prompt_id)
+    else:
+        submit_generation(prompt, chat_id, data, prompt_id, app)
+def send_audio_file(path, mimetype, max_age=None, immutable=False):
+    # send_file answers Range (206) and If-None-Match / If-Modified-Since (304) against its
+    # mtime-size ETag; this only decides how long the browser may skip revalidation
+    if not os.path.exists(path):
+        # Produced on another node: send the browser straight to the blob store, or fetch a copy first
+        url = blob_store.download_url(path)
+        if url is not None:
+            return redirect(url)
+        blob_store.fetch(path)
+    response = send_file(path, mimetype=mimetype, max_age=max_age)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if max_age is None:
+        response.cache_control.no_cache = True
+    elif immutable:
+        response.cache_control.immutable = True
+    return response
+def send_clip(clip_name, message_id):
+    # WAV unless the client asks for another format with ?format= or its Accept header
+    requested = request.args.get('format')
+    fmt = negotiate_format(requested, request.accept_mimetypes)
+    if fmt is None:
+        return make_response(jsonify({'message': f"Unknown format, use one of {', '.join(CLIP_FORMATS)}"}), 400)
+    try:
+        # Only an explicit ?format= waits for the encode; a format picked from Accept gets the WAV until it's ready
+        path = clip_encoder.path_for(clip_name, fmt, wait=bool(requested))
+    except ClipEncodeError as e:
+        logger.error(str(e))
+        response = make_response(jsonify({'message': 'Could not encode audio, try again later'}), 503)
+        response.headers['Retry-After'] = str(ENCODE_RETRY_AFTER_SECONDS)
+        return response
+    if path is None:
+        # Encode pending: the WAV, revalidated so the encoded copy replaces it once it exists
+        response = send_audio_file(clip_path(clip_name), CLIP_FORMATS['wav'].mimetype)
+    # Anonymous clips (temp_ ids) are re-rendered under the same name, so they are revalidated every time
+    elif str(message_id).isdigit():
+        response = send_audio_file(path, CLIP_FORMATS[fmt].mimetype, CLIP_MAX_AGE_SECONDS, immutable=True)
+    else:
+        response = send_audio_file(path, CLIP_FORMATS[fmt].mimetype)
+    response.vary.add('Accept')
+    return response
+def request_stems(clip_name, job):
+    # Someone is waiting on these stems: move them ahead of backfill work, or separate the clip
+    # again when the retention GC has reclaimed its stems since
+    if separation_scheduler.bump(clip_name):
+        return
+    path = clip_path(clip_name)
+    if job and job["status"] == JOB_SAVED and blob_store.fetch(path):
+        separation_scheduler.submit(path, stem_root(clip_name), PRIORITY_ON_DEMAND)
+        logger.info(f"Queued separation of {clip_name} again")
+def queue_full_response(retry_after):
+    response = make_response(jsonify({"error": "Too many generations in progress, try again later", "retry_after": retry_after}), 503)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
 # Google OAuth login
 @routes_bp.route('/auth/google')
 def auth_google():
@@ -118,8 +223,7 @@ def get_me():
     user_id = get_jwt_identity()
     logger.debug(f"Fetching user info for user_id: {user_id}")
     if user_id:
-        user_id = int(user_id)
-        user = User.query.get(user_id)
+        user = current_user
         if user:
             logger.info(f"User found: {user.email}")
             return jsonify({'id': user.id, 'username': user.username, 'email': user.email}), 200
@@ -132,15 +236,25 @@ def get_chats():
     user_id = int(get_jwt_identity())
     logger.debug(f"Fetching chats for user_id: {user_id}, headers: {request.headers}")
     try:
-        chats = Chat.query.filter_by(user_id=user_id).all()
+        limit, cursor, descending = page_args()
+        query = db.session.query(Chat.id, Chat.title, Chat.user_id, Chat.folder_id, Chat.time).filter(Chat.user_id == user_id)
+        chats, next_cursor = keyset_page(query, [Chat.time, Chat.id], limit, cursor, descending)
         logger.debug(f"Chats retrieved: {len(chats)}")
-        if chats:
-            chat_list = [chat.to_dict() for chat in chats]
+        if chats or cursor:
+            chat_list = [{
+                "id": chat.id,
+                "title": chat.title,
+                "user_id": chat.user_id,
+                "folder_id": chat.folder_id,
+                "time": chat.time.isoformat()
+            } for chat in chats]
             logger.info(f"Returning {len(chat_list)} chats for user_id: {user_id}")
-            return make_response(jsonify(chat_list), 200)
+            return paged_response(make_response(jsonify(chat_list), 200), next_cursor)
         else:
             logger.info(f"No chats found for user_id: {user_id}")
             return make_response(jsonify({'message': "No chats yet"}), 200)
+    except InvalidPageRequest as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error fetching chats for user_id {user_id}: {str(e)}")
         return make_response(jsonify({"error": str(e)}), 500)
@@ -150,14 +264,15 @@ def delete_chat(id):
     user_id = int(get_jwt_identity())
     logger.debug(f"Deleting chat id: {id} for user_id: {user_id}")
     try:
-        chat = Chat.query.get(id)
-        if not chat or chat.user_id != user_id:
+        owner_id = identity_cache.chat_owner(id)
+        if owner_id is None or owner_id != user_id:
             logger.warning(f"Chat {id} not found or unauthorized for user_id: {user_id}")
             return make_response(jsonify({"message": "Chat not found or unauthorized"}), 404)
-        for message in chat.messages[:]:
-            delete_audio_files_for_prompt(message.id)
-        db.session.delete(chat)
+        links = delete_chat_rows(db.session, id)
         db.session.commit()
+        identity_cache.forget_chat(id)
+        # Clips, stems and mixes are removed in the background
+        file_cleanup.enqueue(links)
         logger.info(f"Chat {id} deleted successfully")
         return '', 204
     except Exception as e:
@@ -203,54 +318,174 @@ def post_chats():
     if bpm is None or key is None:
         logger.error(f"Missing 'bpm' ({bpm}) or 'key' ({key})")
         return jsonify({"error": "Missing 'bpm' or 'key'"}), 422
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER) if user_id else None
+    if idempotency_key is not None:
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters"}), 422
+        previous = find_previous(int(user_id), idempotency_key)
+        if previous is not None:
+            logger.info(f"Replaying {IDEMPOTENCY_HEADER} {idempotency_key} for user_id: {user_id}")
+            return replay_response(previous)
+    try:
+        cached = generation_cache.lookup(fingerprint(prompt, bpm, key), anonymous=not user_id)
+    except Exception as e:
+        logger.error(f"Generation cache lookup failed: {str(e)}")
+        db.session.rollback()
+        cached = None
+    if cached is None and generation_executor.is_full():
+        db.session.rollback()
+        return queue_full_response(generation_executor.retry_after())
     try:
         app = current_app._get_current_object()
         if user_id:
             user_id = int(user_id)
+            new_chat = None
             if 'chat' not in data:
-                number_of_chats = Chat.query.filter_by(user_id=user_id).count()
-                new_chat = Chat(title=f"Chat {number_of_chats}", user_id=user_id)
-                commit(new_chat)
-                new_exchange = Messages(role="user", content=prompt, convo=new_chat.id)
-                commit(new_exchange)
-                logger.info(f"Created new chat {new_chat.id} with message {new_exchange.id}")
-                # Create Audios record immediately
-                new_audio = Audios(link=f"lyria_{new_chat.id}_{new_exchange.id}", chat=new_chat.id, prompt=new_exchange.id)
-                commit(new_audio)
-                logger.info(f"Successfully created and committed Audios record for chat_id: {new_chat.id}, prompt_id: {new_exchange.id}")
-                Thread(target=create_a_message_and_send_prompt, args=(new_exchange.content, new_chat.id, data, new_exchange.id, app)).start()
-                return jsonify({"new_chat": new_chat.id, "message": new_exchange.id}), 200
+                new_chat = Chat(title=chat_title(prompt), user_id=user_id)
+                db.session.add(new_chat)
+                db.session.flush()
+                chat_id = new_chat.id
             else:
-                new_exchange = Messages(role="user", content=prompt, convo=data["chat"])
-                commit(new_exchange)
-                logger.info(f"Added message {new_exchange.id} to chat {data['chat']}")
-                # Create Audios record immediately
-                new_audio = Audios(link=f"lyria_{data['chat']}_{new_exchange.id}", chat=data["chat"], prompt=new_exchange.id)
-                commit(new_audio)
-                logger.info(f"Successfully created and committed Audios record for chat_id: {data['chat']}, prompt_id: {new_exchange.id}")
-                Thread(target=create_a_message_and_send_prompt, args=(new_exchange.content, data["chat"], data, new_exchange.id, app)).start()
-                return jsonify({"message": new_exchange.id}), 200
+                chat_id = data["chat"]
+                owner_id = identity_cache.chat_owner(chat_id)
+                if owner_id != user_id:
+                    db.session.rollback()
+                    logger.warning(f"Chat {chat_id} not found or unauthorized for user_id: {user_id}")
+                    return make_response(jsonify({"message": "Chat not found or unauthorized"}), 404)
+            # Chat, message, audio and job rows go in as one transaction; flush() hands out the ids
+            new_exchange = Messages(role="user", content=prompt, convo=chat_id)
+            db.session.add(new_exchange)
+            db.session.flush()
+            new_audio = Audios(link=f"lyria_{chat_id}_{new_exchange.id}", chat=chat_id, prompt=new_exchange.id)
+            db.session.add(new_audio)
+            db.session.flush()
+            job_tracker.create(new_audio.link, new_audio.id)
+            if idempotency_key:
+                remember(user_id, idempotency_key, chat_id, new_exchange.id, new_chat is not None)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent retry with the same key committed first; answer with its ids
+                db.session.rollback()
+                previous = find_previous(user_id, idempotency_key) if idempotency_key else None
+                if previous is None:
+                    raise
+                return replay_response(previous)
+            if new_chat is not None:
+                identity_cache.remember_chat(chat_id, user_id)
+            logger.info(f"Created message {new_exchange.id} and audio {new_audio.link} in chat {chat_id}")
+            try:
+                start_generation(prompt, chat_id, data, new_exchange.id, app, cached)
+            except GenerationQueueFull as e:
+                # Lost the race for the last pending slot; don't leave an empty chat or message behind
+                if idempotency_key:
+                    IdempotencyKeys.query.filter_by(user_id=user_id, key=idempotency_key).delete()
+                db.session.delete(new_audio)
+                db.session.delete(new_chat if new_chat is not None else new_exchange)
+                db.session.commit()
+                if new_chat is not None:
+                    identity_cache.forget_chat(chat_id)
+                return queue_full_response(e.retry_after)
+            return jsonify(talk_response_body(chat_id, new_exchange.id, new_chat is not None)), 200
         else:
             # Handle non-logged-in users
             # Use a temporary chat_id and prompt_id
             chat_id = "temp"
-            prompt_id = f"temp_{hash(prompt + str(bpm) + str(key)) % 1000000}" # Unique temp ID
-            Thread(target=create_a_message_and_send_prompt, args=(prompt, chat_id, data, prompt_id, app)).start()
+            prompt_id = f"temp_{fingerprint(prompt, bpm, key)[:12]}" # Stable temp ID, same across processes
+            if live_streams.get(f"lyria_{chat_id}_{prompt_id}") or job_tracker.is_active(f"lyria_{chat_id}_{prompt_id}"):
+                # The same prompt is already queued or rendering, here or on another node
+                db.session.rollback()
+                return jsonify({"message": prompt_id}), 200
+            job_tracker.create(f"lyria_{chat_id}_{prompt_id}")
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent request for the same prompt created the job first and submits it
+                db.session.rollback()
+                return jsonify({"message": prompt_id}), 200
+            try:
+                start_generation(prompt, chat_id, data, prompt_id, app, cached)
+            except GenerationQueueFull:
+                job_tracker.set_status(f"lyria_{chat_id}_{prompt_id}", JOB_FAILED, "Generation queue full")
+                raise
             return jsonify({"message": prompt_id}), 200
+    except GenerationQueueFull as e:
+        return queue_full_response(e.retry_after)
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Internal error in post_chats: {str(e)}")
         return jsonify({"error": f"Internal error: {str(e)}"}), 500
+@routes_bp.route('/api/generation/stats', methods=['GET'])
+@jwt_required()
+def get_generation_stats():
+    stats = generation_executor.stats()
+    stats["cache"] = generation_cache.stats()
+    return jsonify(stats), 200
+@routes_bp.route('/api/separation/stats', methods=['GET'])
+@jwt_required()
+def get_separation_stats():
+    stats = separation_scheduler.stats()
+    stats["stem_cache"] = stem_cache.stats()
+    stats["mix_cache"] = mix_cache.stats()
+    stats["file_cleanup"] = file_cleanup.stats()
+    stats["retention"] = retention_collector.stats()
+    stats["blob_store"] = blob_store.stats()
+    stats["clip_encoder"] = clip_encoder.stats()
+    stats["waveform_peaks"] = waveform_peaks.stats()
+    return jsonify(stats), 200
 @routes_bp.route('/get-audio/<chat_id>/<message_id>')
 @jwt_required(optional=True)
 def get_audio(chat_id, message_id):
     user_id = get_jwt_identity()
     logger.debug(f"Fetching audio for chat_id: {chat_id}, message_id: {message_id}, user_id: {user_id}")
-    file_path = f'{music_folder}/lyria_{chat_id}_{message_id}.wav'
+    clip_name = f"lyria_{chat_id}_{message_id}"
     try:
-        return send_file(file_path, mimetype='audio/wav')
+        return send_clip(clip_name, message_id)
     except FileNotFoundError:
-        logger.error(f"Audio file not found: {file_path}")
+        logger.error(f"Audio file not found: {clip_path(clip_name)}")
         return make_response(jsonify({'message': 'No audio available'}), 404)
+@routes_bp.route('/stream-audio/<chat_id>/<message_id>')
+@jwt_required(optional=True)
+def stream_audio(chat_id, message_id):
+    # Same clip as /get-audio, but starts sending as soon as Lyria's first chunks arrive
+    clip_name = f"lyria_{chat_id}_{message_id}"
+    file_path = clip_path(clip_name)
+    stream = live_streams.get(clip_name)
+    if stream is None:
+        try:
+            return send_clip(clip_name, message_id)
+        except FileNotFoundError:
+            logger.error(f"No audio or live generation for {clip_name}")
+            return make_response(jsonify({'message': 'No audio available'}), 404)
+    f = stream.open_reader(LIVE_STREAM_WAIT_SECONDS)
+    if f is None:
+        if os.path.exists(file_path):
+            return send_clip(clip_name, message_id)
+        logger.warning(f"Generation for {clip_name} has not started writing audio yet")
+        return make_response(jsonify({'message': 'Audio not ready yet'}), 404)
+    logger.debug(f"Streaming {clip_name} while it is being generated")
+    response = Response(stream_wav(stream, f, LIVE_STREAM_IDLE_SECONDS), mimetype='audio/wav')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+@routes_bp.route('/api/jobs/<chat_id>/<message_id>')
+@jwt_required(optional=True)
+def get_job_status(chat_id, message_id):
+    # Pass ?since=<status>&wait=<seconds> to long-poll until the status changes
+    clip_name = f"lyria_{chat_id}_{message_id}"
+    since = request.args.get('since')
+    wait = min(request.args.get('wait', 0, type=float), JOB_LONG_POLL_MAX_SECONDS)
+    job = job_tracker.wait(clip_name, since, wait) if since and wait > 0 else job_tracker.get(clip_name)
+    if job is None:
+        return make_response(jsonify({'message': 'Job not found'}), 404)
+    return jsonify(job), 200
+@routes_bp.route('/api/jobs/<chat_id>/<message_id>/events')
+@jwt_required(optional=True)
+def stream_job_status(chat_id, message_id):
+    clip_name = f"lyria_{chat_id}_{message_id}"
+    response = Response(stream_with_context(job_tracker.events(clip_name)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 @routes_bp.route('/all-audios/<int:user_id>')
 @jwt_required()
 def get_audios(user_id):
@@ -259,9 +494,19 @@ def get_audios(user_id):
     if current_id != user_id:
         logger.warning(f"Unauthorized access attempt: current_id {current_id} != user_id {user_id}")
         return jsonify({'error': 'Unauthorized'}), 403
-    audios = Audios.query.join(Chat).filter(Chat.id == Audios.chat, Chat.user_id == user_id).all()
+    try:
+        limit, cursor, descending = page_args()
+    except InvalidPageRequest as e:
+        return jsonify({"error": str(e)}), 400
+    # duration is null until the clip has been saved and measured
+    query = (db.session.query(Audios.id, Audios.link, Audios.chat, Audios.prompt, ClipMetadata.duration)
+             .join(Chat, Chat.id == Audios.chat).outerjoin(ClipMetadata, ClipMetadata.link == Audios.link)
+             .filter(Chat.user_id == user_id))
+    audios, next_cursor = keyset_page(query, [Audios.id], limit, cursor, descending)
     logger.info(f"Retrieved {len(audios)} audios for user_id: {user_id}")
-    return jsonify([{"id": audio.id, "name": f"{audio.link}.wav", "chat": audio.chat, "prompt": audio.prompt} for audio in audios]), 200
+    response = make_response(jsonify([{"id": audio.id, "name": f"{audio.link}.wav", "chat": audio.chat, "prompt": audio.prompt,
+                                       "duration": audio.duration} for audio in audios]), 200)
+    return paged_response(response, next_cursor)
 @routes_bp.route('/getmessages/<chat_id>')
 @jwt_required(optional=True)
 def get_messages(chat_id):
@@ -270,19 +515,27 @@ def get_messages(chat_id):
     try:
         if user_id:
             user_id = int(user_id)
-            convo = Chat.query.get(chat_id)
-            if not convo or convo.user_id != user_id:
+            owner_id = identity_cache.chat_owner(chat_id)
+            if owner_id is None or owner_id != user_id:
                 logger.warning(f"Chat {chat_id} not found or unauthorized for user_id: {user_id}")
                 return make_response(jsonify({'error': 'Unauthorized'}), 403)
-            messages = convo.messages
-            message_list = []
-            if messages:
-                message_list = [msg.to_dict() for msg in messages]
+            limit, cursor, descending = page_args()
+            query = db.session.query(Messages.id, Messages.role, Messages.content, Messages.convo, Messages.time).filter(Messages.convo == chat_id)
+            messages, next_cursor = keyset_page(query, [Messages.time, Messages.id], limit, cursor, descending)
+            message_list = [{
+                "id": msg.id,
+                "role": msg.role,
+                "content": msg.content,
+                "convo": msg.convo,
+                "time": msg.time.isoformat()
+            } for msg in messages]
             logger.info(f"Retrieved {len(message_list)} messages for chat id: {chat_id}")
-            return make_response(jsonify(message_list), 200)
+            return paged_response(make_response(jsonify(message_list), 200), next_cursor)
         else:
             # Return empty messages for non-logged-in users
             return make_response(jsonify([]), 200)
+    except InvalidPageRequest as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         logger.error(f"Error fetching messages for chat id {chat_id}: {str(e)}")
         return make_response(jsonify({"message": str(e)}), 500)
@@ -290,10 +543,13 @@ def get_messages(chat_id):
 def delete_prompt_and_audio_route(prompt_id):
     logger.debug(f"Deleting prompt and audio for prompt_id: {prompt_id}")
     try:
-        delete_prompt_and_audio(db.session, prompt_id)
+        links = delete_prompt_and_audio(db.session, prompt_id)
+        if links:
+            file_cleanup.enqueue(links)
         logger.info(f"Prompt {prompt_id} and associated audio files deleted")
         return make_response(jsonify({"message": f"Prompt {prompt_id} and associated audio files deleted."}), 200)
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error deleting prompt {prompt_id}: {str(e)}")
         return make_response(jsonify({"error": str(e)}), 500)
 @routes_bp.route('/api/music-files', methods=['GET'])
@@ -311,31 +567,26 @@ def get_mixer_data(filename):
     logger.debug(f"Fetching mixer data for filename: {filename}")
     try:
         file_basename = os.path.splitext(filename)[0]
-        expected_dir = os.path.join(SEPARATED_DIR, DEMUCS_MODEL_NAME, file_basename)
-        if not os.path.isdir(expected_dir):
-            logger.info(f"Separation not started for {filename}")
-            status_data = {"status": "not_started", "channels": []}
-            message = "Separation not started yet"
+        manifest = stem_manifests.get(file_basename)
+        if manifest is not None:
+            status_data = {
+                "status": "complete",
+                "channels": manifest.names,
+                "stems": manifest.stems,
+                "message": "Separation complete and ready for mixing"
+            }
         else:
-            expected_channels = ['drums', 'bass', 'other', 'vocals']
-            available_channels = []
-            for channel in expected_channels:
-                channel_file = os.path.join(expected_dir, f"{channel}.mp3")
-                if os.path.exists(channel_file):
-                    available_channels.append(channel)
-            if len(available_channels) == len(expected_channels):
-                status_data = {
-                    "status": "complete",
-                    "channels": available_channels,
-                    "message": "Separation complete and ready for mixing"
-                }
+            job = job_tracker.get(file_basename)
+            request_stems(file_basename, job)
+            status = job["status"] if job else None
+            if status == JOB_SEPARATING:
+                status_data = {"status": "processing", "channels": [], "message": "Separating stems..."}
+            elif status == JOB_FAILED:
+                status_data = {"status": "failed", "channels": [], "message": job["error"] or "Separation failed"}
             else:
-                status_data = {
-                    "status": "processing",
-                    "channels": available_channels,
-                    "message": f"Processing... {len(available_channels)}/{len(expected_channels)} channels ready"
-                }
-        logger.info(f"Mixer data for {filename}: {status_data}")
+                logger.info(f"Separation not started for {filename}")
+                status_data = {"status": "not_started", "channels": []}
+        logger.info(f"Mixer data for {filename}: {status_data['status']}")
         return jsonify({
             "filename": filename,
             "separation_status": status_data,
@@ -355,51 +606,45 @@ def mix_and_download():
         return jsonify({"error": "Filename is required"}), 400
     try:
         file_basename = os.path.splitext(filename)[0]
-        separated_dir = os.path.join(SEPARATED_DIR, DEMUCS_MODEL_NAME, file_basename)
-        if not os.path.exists(separated_dir):
+        manifest = stem_manifests.get(file_basename)
+        if manifest is None:
             logger.error(f"Separated tracks not found for {filename}")
             return jsonify({"error": "Separated tracks not found"}), 404
         output_filename = f"{file_basename}_mixed.wav"
-        output_path = os.path.join(SEPARATED_DIR, output_filename)
-        non_vocal_channels = ['drums', 'bass', 'other']
-        input_files = []
-        volume_filters = []
-        for i, channel in enumerate(non_vocal_channels):
-            channel_file = os.path.join(separated_dir, f"{channel}.mp3")
-            if os.path.exists(channel_file):
-                input_files.append(f"-i {channel_file}")
-                volume = track_volumes.get(channel, 1.0)
-                if volume > 0:
-                    volume_db = 20 * math.log10(volume)
-                    volume_filters.append(f"[{i}:a]volume={volume_db}dB[a{i}]")
-                else:
-                    volume_filters.append(f"[{i}:a]volume=0dB[a{i}]")
-        if not input_files:
+        channels = [channel for channel in MIX_CHANNELS if channel in manifest.names]
+        if not channels:
             logger.error("No tracks found to mix")
             return jsonify({"error": "No tracks found to mix"}), 404
-        filter_complex = ";".join(volume_filters)
-        if len(input_files) > 1:
-            mix_inputs = "".join([f"[a{i}]" for i in range(len(input_files))])
-            filter_complex += f";{mix_inputs}amix=inputs={len(input_files)}:duration=longest[out]"
-        else:
-            filter_complex += ";[a0]copy[out]"
-        input_args = " ".join(input_files)
-        ffmpeg_cmd = f'ffmpeg {input_args} -filter_complex "{filter_complex}" -map "[out]" -y "{output_path}"'
-        logger.debug(f"Running FFmpeg command: {ffmpeg_cmd}")
-        result = subprocess.run(ffmpeg_cmd, shell=True, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"FFmpeg error: {result.stderr}")
-            return jsonify({"error": f"FFmpeg mixing failed: {result.stderr}"}), 500
-        if not os.path.exists(output_path):
-            logger.error("Failed to create mixed audio file")
-            return jsonify({"error": "Failed to create mixed audio file"}), 500
-        logger.info(f"Successfully mixed audio: {output_filename}")
-        return send_file(
-            output_path,
+        gains = quantize_gains(track_volumes)
+        cached_path = mix_cache.path_for(file_basename, gains, "wav", manifest.version)
+        mix_file = mix_cache.get(cached_path)
+        if mix_file is None:
+            separated_dir = stem_dir(file_basename, manifest.model)
+            for channel in channels:
+                blob_store.fetch(separated_dir / f"{channel}.mp3")
+            stems = stem_cache.load_stems(separated_dir, channels)
+            missing = [channel for channel in channels if channel not in stems]
+            if missing:
+                # Never cache a partial mix under the full manifest version
+                logger.error(f"Stems {', '.join(missing)} of {filename} are unavailable")
+                return jsonify({"error": f"Separated tracks unavailable: {', '.join(missing)}"}), 503
+            mix_file = mix_cache.store(cached_path, stream_wav_mix(mix_stems(stems, gains)))
+            logger.info(f"Mixed {', '.join(stems)} for {filename}")
+        response = send_file(
+            mix_file,
             mimetype='audio/wav',
             as_attachment=True,
             download_name=output_filename
         )
+        # send_file only knows the size of paths, not of open files
+        response.content_length = os.fstat(mix_file.fileno()).st_size
+        return response
+    except InvalidGains as e:
+        logger.error(f"Invalid trackVolumes for {filename}: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except StemDecodeError as e:
+        logger.error(f"Error decoding stems: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         logger.error(f"Error mixing audio: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -409,35 +654,55 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
-def run_demucs_in_background(input_path, output_path):
-    if os.name == 'nt':
-        python_executable = os.path.join(CONDA_ENV_PATH, "Scripts", "python.exe")
-    else:
-        python_executable = os.path.join(CONDA_ENV_PATH, "bin", "python")
-    script_path = os.path.join(BASE_DIR, "separator.py")
-    if not os.path.exists(python_executable):
-        logger.error(f"FATAL ERROR: Conda python executable not found at {python_executable}")
-        return
-    command = [python_executable, script_path, input_path, output_path]
-    logger.debug(f"Starting background process: {' '.join(command)}")
-    subprocess.Popen(command)
-    logger.info("Background process started.")
 @routes_bp.route('/api/separated-channels/<filename>', methods=['GET'])
 def get_separated_channels(filename):
     file_basename = os.path.splitext(filename)[0]
-    expected_dir = os.path.join(SEPARATED_DIR, DEMUCS_MODEL_NAME, file_basename)
-    if not os.path.isdir(expected_dir):
-        return jsonify({"status": "processing", "channels": []}), 202
     try:
-        channels = [os.path.splitext(f)[0] for f in os.listdir(expected_dir) if f.endswith('.mp3')]
-        return jsonify({"status": "complete", "channels": channels})
+        manifest = stem_manifests.get(file_basename)
+        if manifest is None:
+            request_stems(file_basename, job_tracker.get(file_basename))
+            return jsonify({"status": "processing", "channels": []}), 202
+        return jsonify({"status": "complete", "channels": manifest.names})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+@routes_bp.route('/api/peaks/<filename>', methods=['GET'])
+@routes_bp.route('/api/peaks/<filename>/<channel>', methods=['GET'])
+def get_peaks(filename, channel=None):
+    # Waveform of a clip or one of its stems; ?width=<pixels> picks the resolution
+    link = os.path.splitext(filename)[0]
+    if channel is not None and channel not in STEM_NAMES:
+        return jsonify({"error": "Channel not found"}), 404
+    if safe_join(str(stem_root(link)), link) is None:
+        return jsonify({"error": "Audio not found"}), 404
+    try:
+        path = waveform_peaks.path_for(link, channel)
+    except (FileNotFoundError, ValueError):
+        return jsonify({"error": "Audio not found"}), 404
+    except Exception as e:
+        logger.error(f"Could not compute waveform peaks of {filename} {channel or ''}: {e}")
+        return jsonify({"error": "Could not compute waveform"}), 500
+    width = request.args.get('width', type=int)
+    response = make_response(jsonify(read_peaks(path, width)), 200)
+    # Tagged with the peaks file and resolution, so a re-rendered clip or re-separated stem gets a new one
+    st = os.stat(path)
+    response.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}-{width or 0}")
+    response.cache_control.private = True
+    if channel is not None:
+        response.cache_control.max_age = STEM_MAX_AGE_SECONDS
+    elif link.startswith(ANONYMOUS_PREFIX):
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = CLIP_MAX_AGE_SECONDS
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
 @routes_bp.route('/api/stream-channel/<filename>/<channel>', methods=['GET'])
 def stream_channel(filename, channel):
     file_basename = os.path.splitext(filename)[0]
     channel_filename = f"{channel}.mp3"
-    directory = os.path.join(SEPARATED_DIR, DEMUCS_MODEL_NAME, file_basename)
-    if not os.path.exists(os.path.join(directory, channel_filename)):
+    channel_path = safe_join(str(stem_root(file_basename)), DEMUCS_MODEL_NAME, file_basename, channel_filename)
+    if channel not in STEM_NAMES or channel_path is None:
         return jsonify({"error": "Channel not found"}), 404
-    return send_from_directory(directory, channel_filename, mimetype='audio/mpeg')
\ No newline at end of file
+    try:
+        return send_audio_file(channel_path, 'audio/mpeg', STEM_MAX_AGE_SECONDS)
+    except FileNotFoundError:
+        return jsonify({"error": "Channel not found"}), 404
\ No newline at end of file
@@ -0,0 +1,254 @@
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SEPARATOR_SCRIPT = os.path.join(BASE_DIR, "separator.py")
+# Importing torch and loading htdemucs_ft happens before the service answers its first job
+STARTUP_TIMEOUT_SECONDS = 180
+# Lower runs first: stems someone is waiting on in the mixer jump ahead of backfill
+PRIORITY_ON_DEMAND = 0
+PRIORITY_BACKFILL = 10
+
+
+class SeparationUnavailable(Exception):
+    pass
+
+
+def default_python():
+    if os.getenv("USEVENV") == "true":
+        env_path = os.path.join(BASE_DIR, "venv")
+    else:
+        env_path = "/opt/anaconda3/envs/demucs-env"
+    if os.name == 'nt':
+        return os.path.join(env_path, "Scripts", "python.exe")
+    return os.path.join(env_path, "bin", "python")
+
+
+class SeparationService:
+    """Client for one long-lived `separator.py --serve` process.
+
+    The service is started on first use with the Demucs environment's interpreter
+    and keeps the model loaded between jobs; if one is already listening on the
+    address (started by another API worker, or by hand) it is reused.
+    """
+
+    def __init__(self, address, authkey, python_executable):
+        self.address = address
+        self.authkey = authkey
+        self.python_executable = python_executable
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _host_port(self):
+        host, port = self.address.rsplit(":", 1)
+        return host, int(port)
+
+    def _spawn(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        if not os.path.exists(self.python_executable):
+            raise SeparationUnavailable(f"Python executable not found at {self.python_executable}")
+        env = dict(os.environ, SEPARATION_AUTHKEY=self.authkey.decode())
+        command = [self.python_executable, SEPARATOR_SCRIPT, "--serve", self.address]
+        logger.info(f"Starting separation service: {' '.join(command)}")
+        self._process = subprocess.Popen(command, env=env)
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        spawned = False
+        while True:
+            try:
+                self._conn = Client(self._host_port(), authkey=self.authkey)
+                return self._conn
+            except AuthenticationError:
+                raise SeparationUnavailable(f"Separation service on {self.address} rejected our SEPARATION_AUTHKEY")
+            except ConnectionRefusedError:
+                if not spawned:
+                    self._spawn()
+                    spawned = True
+                if self._process is not None and self._process.poll() is not None:
+                    raise SeparationUnavailable(f"Separation service exited with code {self._process.returncode}")
+                if time.monotonic() > deadline:
+                    raise SeparationUnavailable(f"Separation service did not start within {STARTUP_TIMEOUT_SECONDS}s")
+                time.sleep(0.5)
+
+    def _drop_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+        self._conn = None
+
+    def separate(self, input_path, output_dir, threads=None):
+        """Run one job on the service and return its report (stems and per-stage timings)."""
+        job = {"input": str(input_path), "output": str(output_dir), "threads": threads}
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    conn = self._connect()
+                    conn.send(job)
+                    result = conn.recv()
+                    break
+                except (EOFError, OSError) as e:
+                    # The service restarted or died mid-job; reconnect (and respawn) once
+                    logger.warning(f"Lost connection to separation service: {e}")
+                    self._drop_connection()
+                    if attempt:
+                        raise SeparationUnavailable(f"Separation service connection failed: {e}")
+        if not result.get("ok"):
+            raise Exception(result.get("error", "Separation failed"))
+        logger.info(f"Separated {result['track']} in {result['total_seconds']}s "
+                    f"(decode {result['decode_seconds']}s, separate {result['separate_seconds']}s, "
+                    f"save {result['save_seconds']}s, waited {result['wait_seconds']}s)")
+        return result
+
+
+class SeparationScheduler:
+    """Priority queue of separation jobs drained by at most `max_parallel` services.
+
+    Each slot owns one separation service (its own process and port, counting up
+    from SEPARATION_SERVICE_ADDRESS), so at most `max_parallel` models run at once
+    and each job is capped at `torch_threads` CPU threads. Finished clips are queued
+    as backfill; opening one in the mixer bumps it to on-demand priority.
+    """
+
+    def __init__(self):
+        self.max_parallel = 1
+        self.torch_threads = None
+        self.services = []
+        self._heap = []
+        self._jobs = {}
+        self._running = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._completed = 0
+        self._failed = 0
+
+    def init_app(self, app):
+        self.max_parallel = max(1, app.config.get("SEPARATION_MAX_PARALLEL", self.max_parallel))
+        self.torch_threads = app.config.get("SEPARATION_TORCH_THREADS") or max(1, (os.cpu_count() or 1) // self.max_parallel)
+        # Every API process of a deployment must share the key to share the services
+        authkey = app.config.get("SEPARATION_AUTHKEY")
+        if not authkey:
+            if not app.config.get("SECRET_KEY"):
+                raise RuntimeError("Set SEPARATION_AUTHKEY or SECRET_KEY: the separation service needs a shared authkey")
+            authkey = hashlib.sha256(f"separation:{app.config['SECRET_KEY']}".encode()).hexdigest()
+        python_executable = app.config.get("DEMUCS_PYTHON") or default_python()
+        host, port = app.config.get("SEPARATION_SERVICE_ADDRESS", "127.0.0.1:6123").rsplit(":", 1)
+        self.services = [SeparationService(f"{host}:{int(port) + i}", authkey.encode(), python_executable)
+                         for i in range(self.max_parallel)]
+        app.extensions["separation_scheduler"] = self
+
+    def _start(self):
+        # Workers are started lazily, like the generation executor's
+        with self._cond:
+            if self._workers:
+                return
+            for i, service in enumerate(self.services):
+                worker = threading.Thread(target=self._run, args=(service,), name=f"separation-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, input_path, output_dir, priority=PRIORITY_BACKFILL):
+        self._start()
+        track = os.path.splitext(os.path.basename(str(input_path)))[0]
+        with self._cond:
+            job = self._jobs.get(track)
+            if job is None:
+                self._jobs[track] = job = {"input": input_path, "output": output_dir, "priority": priority}
+            elif priority >= job["priority"]:
+                return
+            job["priority"] = priority
+            heapq.heappush(self._heap, (priority, next(self._seq), track))
+            self._cond.notify()
+        logger.debug(f"Queued separation of {track} with priority {priority}")
+
+    def bump(self, track):
+        # Called from the mixer endpoints; only affects jobs that are still waiting or running.
+        # Returns False when the scheduler doesn't know the track at all.
+        with self._cond:
+            if track in self._running:
+                return True
+            job = self._jobs.get(track)
+            if job is None:
+                return False
+            if job["priority"] <= PRIORITY_ON_DEMAND:
+                return True
+            job["priority"] = PRIORITY_ON_DEMAND
+            heapq.heappush(self._heap, (PRIORITY_ON_DEMAND, next(self._seq), track))
+            self._cond.notify()
+        logger.info(f"Bumped separation of {track} to on-demand priority")
+        return True
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    priority, _, track = heapq.heappop(self._heap)
+                    job = self._jobs.get(track)
+                    # Skip stale heap entries left behind by bumps
+                    if job is not None and job["priority"] == priority:
+                        del self._jobs[track]
+                        self._running.add(track)
+                        return track, job
+                self._cond.wait()
+
+    def _run(self, service):
+        # Imported here so this module has no model imports at load time
+        from .jobs import job_tracker, JOB_SEPARATING, JOB_STEMS_READY, JOB_FAILED
+        from .stem_manifests import stem_manifests
+        from .blob_store import blob_store
+        from .waveforms import waveform_peaks
+        while True:
+            track, job = self._next()
+            job_tracker.set_status(track, JOB_SEPARATING)
+            try:
+                # The clip may have been generated on another node
+                if not blob_store.fetch(job["input"]):
+                    raise FileNotFoundError(f"{job['input']} is not in the blob store")
+                result = service.separate(job["input"], job["output"], threads=self.torch_threads)
+                blob_store.upload_stems(result["output_dir"])
+                # The manifest goes in before the status flips, so anyone told "stems_ready" can read it
+                stem_manifests.record(track, result["model"], result["stems"])
+                job_tracker.set_status(track, JOB_STEMS_READY)
+                waveform_peaks.enqueue(track, [stem["name"] for stem in result["stems"]])
+                with self._cond:
+                    self._completed += 1
+            except Exception as e:
+                logger.error(f"Demucs separation for {track} failed: {e}")
+                job_tracker.set_status(track, JOB_FAILED, f"Stem separation failed: {e}")
+                with self._cond:
+                    self._failed += 1
+            finally:
+                with self._cond:
+                    self._running.discard(track)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_parallel": self.max_parallel,
+                "torch_threads": self.torch_threads,
+                "queued": len(self._jobs),
+                "on_demand": sum(1 for job in self._jobs.values() if job["priority"] <= PRIORITY_ON_DEMAND),
+                "running": sorted(self._running),
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+
+separation_scheduler = SeparationScheduler()
@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .mixer import decode_stem, MIX_CHANNELS
+
+logger = logging.getLogger(__name__)
+
+DECODED_SUFFIX = ".f32.npy"
+
+
+def decoded_path(stem_path):
+    # drums.mp3 -> drums.f32.npy in the same directory, so it goes away with the stems
+    return os.path.splitext(str(stem_path))[0] + DECODED_SUFFIX
+
+
+class StemCache:
+    """Decoded stems stored as float32 .npy files next to the MP3s and memory-mapped on use.
+
+    The first mix of a track decodes each stem once and saves it; later mixes (in this
+    or any other worker process) map the saved array, so the pages are shared through
+    the OS page cache instead of being decoded into private memory again. Mapped stems
+    are kept in an LRU bounded by `max_bytes`.
+    """
+
+    def __init__(self):
+        self.max_bytes = 512 * 1024 ** 2
+        self._mapped = OrderedDict()
+        self._mapped_bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._decodes = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get("STEM_CACHE_MAX_BYTES", self.max_bytes)
+        app.extensions["stem_cache"] = self
+
+    def load(self, stem_path):
+        """Return the stem as a read-only (frames, channels) float32 array."""
+        stem_path = str(stem_path)
+        npy_path = decoded_path(stem_path)
+        stem_mtime = os.stat(stem_path).st_mtime_ns
+        with self._lock:
+            entry = self._mapped.get(stem_path)
+            if entry is not None and entry[0] == stem_mtime:
+                self._mapped.move_to_end(stem_path)
+                self._hits += 1
+                return entry[1]
+        try:
+            if os.stat(npy_path).st_mtime_ns < stem_mtime:
+                raise FileNotFoundError(npy_path)
+            samples = np.load(npy_path, mmap_mode="r")
+            with self._lock:
+                self._loads += 1
+        except (FileNotFoundError, ValueError):
+            samples = self._decode(stem_path, npy_path)
+        self._remember(stem_path, stem_mtime, samples)
+        return samples
+
+    def _decode(self, stem_path, npy_path):
+        samples = decode_stem(stem_path)
+        # Written under a unique name and renamed, so concurrent decodes never expose a partial array
+        temp_path = f"{npy_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.save(f, samples)
+            os.replace(temp_path, npy_path)
+        except OSError as e:
+            logger.warning(f"Could not save decoded stem {npy_path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return samples
+        with self._lock:
+            self._decodes += 1
+        logger.info(f"Decoded {stem_path} into {npy_path}")
+        return np.load(npy_path, mmap_mode="r")
+
+    def _remember(self, stem_path, stem_mtime, samples):
+        with self._lock:
+            previous = self._mapped.pop(stem_path, None)
+            if previous is not None:
+                self._mapped_bytes -= previous[1].nbytes
+            self._mapped[stem_path] = (stem_mtime, samples)
+            self._mapped_bytes += samples.nbytes
+            # Dropping the last reference unmaps the file; arrays still used by a mix stay valid
+            while self._mapped_bytes > self.max_bytes and len(self._mapped) > 1:
+                _, (_, evicted) = self._mapped.popitem(last=False)
+                self._mapped_bytes -= evicted.nbytes
+
+    def load_stems(self, stem_dir, channels=MIX_CHANNELS):
+        """Load whichever of `channels` exist in `stem_dir`; returns name -> float32 array."""
+        stems = {}
+        for channel in channels:
+            path = os.path.join(stem_dir, f"{channel}.mp3")
+            if os.path.exists(path):
+                stems[channel] = self.load(path)
+        return stems
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mapped_stems": len(self._mapped),
+                "mapped_bytes": self._mapped_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "loads": self._loads,
+                "decodes": self._decodes,
+            }
+
+
+stem_cache = StemCache()
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import os
+import sys
+
+from .. import db
+from ..models import StemManifest
+
+logger = logging.getLogger(__name__)
+
+
+class StemManifestIndex:
+    """Looks up and records which stems a clip has, keyed by the clip's link.
+
+    A manifest is written only after a separation has moved its complete stem
+    directory into place, so having one means every listed file is there.
+    """
+
+    def __init__(self):
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["stem_manifests"] = self
+
+    def get(self, link):
+        return db.session.get(StemManifest, link)
+
+    def record(self, link, model, stems):
+        # Runs in the separation workers, outside any request
+        with self.app.app_context():
+            try:
+                db.session.merge(StemManifest(link=link, model=model, stems=stems))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        logger.info(f"Recorded {len(stems)} stems for {link}")
+
+
+stem_manifests = StemManifestIndex()
+
+
+def backfill(separated_dir, model_name):
+    """Write manifests for stem directories separated before manifests existed."""
+    from .mixer import decode_stem, MIX_SAMPLE_RATE
+    from .generation_cache import STEM_NAMES
+    from .storage import iter_shards
+
+    recorded = 0
+    for shard_dir in iter_shards(separated_dir):
+        model_dir = os.path.join(shard_dir, model_name)
+        links = sorted(os.listdir(model_dir)) if os.path.isdir(model_dir) else []
+        for link in links:
+            stem_dir = os.path.join(model_dir, link)
+            paths = [os.path.join(stem_dir, f"{name}.mp3") for name in STEM_NAMES]
+            if link.endswith(".tmp") or stem_manifests.get(link) is not None or not all(os.path.exists(p) for p in paths):
+                continue
+            stems = []
+            for name, path in zip(STEM_NAMES, paths):
+                with open(path, "rb") as f:
+                    checksum = hashlib.sha256(f.read()).hexdigest()
+                duration = len(decode_stem(path)) / MIX_SAMPLE_RATE
+                stems.append({"name": name, "size": os.path.getsize(path), "duration": round(duration, 3), "sha256": checksum})
+            stem_manifests.record(link, model_name, stems)
+            recorded += 1
+    return recorded
+
+
+if __name__ == "__main__":
+    # python -m app.chats.stem_manifests  (run from the directory the API runs in, after app.chats.storage)
+    from app import create_app
+    # Through the package, so this uses the index create_app() initialised rather than this module's copy
+    from app.chats.stem_manifests import backfill
+    from app.chats.storage import SEPARATED_DIR, DEMUCS_MODEL_NAME
+
+    app = create_app()
+    with app.app_context():
+        count = backfill(SEPARATED_DIR, DEMUCS_MODEL_NAME)
+    print(f"Recorded manifests for {count} separated tracks")
+    sys.exit(0)
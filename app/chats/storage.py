@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import sys
+from pathlib import Path
+
+from .wav_writer import partial_target
+
+logger = logging.getLogger(__name__)
+
+# Roots of everything the API writes, relative to the directory it runs in
+BASE_DIR = Path.cwd()
+DOWNLOAD_DIR = BASE_DIR / "MusicDownloadFiles"
+SEPARATED_DIR = BASE_DIR / "separated_music"
+MIX_DIR = SEPARATED_DIR / "mixes"
+DEMUCS_MODEL_NAME = "htdemucs_ft"  # music model!
+DOWNLOAD_DIR.mkdir(exist_ok=True)
+SEPARATED_DIR.mkdir(exist_ok=True)
+
+# Two levels of 256 directories keep every directory small up to tens of millions of clips
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def shard(link):
+    """Relative shard directory of a clip, e.g. `3f/a0`, derived from its link alone."""
+    digest = hashlib.sha256(link.encode("utf-8")).hexdigest()
+    return Path(*(digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)))
+
+
+def clip_path(link, suffix=".wav"):
+    return DOWNLOAD_DIR / shard(link) / f"{link}{suffix}"
+
+
+def stem_root(link):
+    # The separator writes <root>/<model>/<link>, the layout Demucs itself uses
+    return SEPARATED_DIR / shard(link)
+
+
+def stem_dir(link, model=DEMUCS_MODEL_NAME):
+    return stem_root(link) / model / link
+
+
+def mix_dir(link, root=MIX_DIR):
+    return Path(root) / shard(link) / link
+
+
+def is_shard_name(name):
+    return len(name) == SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)
+
+
+def iter_shards(root):
+    """Yield every leaf shard directory under `root`."""
+    dirs = [Path(root)]
+    for _ in range(SHARD_LEVELS):
+        children = []
+        for directory in dirs:
+            try:
+                children.extend(Path(entry.path) for entry in os.scandir(directory)
+                                if entry.is_dir() and is_shard_name(entry.name))
+            except FileNotFoundError:
+                pass
+        dirs = children
+    return dirs
+
+
+def _move(src, dst, dry_run):
+    if dst.exists():
+        logger.warning(f"Not moving {src}: {dst} already exists")
+        return False
+    if not dry_run:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, dst)
+    return True
+
+
+def migrate_flat_layout(dry_run=False):
+    """Move clips, stems and mixes from the old flat directories into their shards.
+
+    Safe to run more than once; renames keep hard links, timestamps and decoded stems intact.
+    Returns the number of clips, stem directories and mix directories moved.
+    """
+    moved = {"clips": 0, "stems": 0, "mixes": 0}
+    for entry in os.scandir(DOWNLOAD_DIR):
+        if not entry.is_file():
+            continue
+        # Partial files (<clip>.wav.<pid>.<thread>.part) follow their clip into its shard
+        target = partial_target(entry.name) or entry.name
+        if target.endswith(".wav"):
+            moved["clips"] += _move(Path(entry.path), clip_path(target[:-len(".wav")]).with_name(entry.name), dry_run)
+    for model_dir in os.scandir(SEPARATED_DIR):
+        # Old model directories are the only non-shard directories holding stems
+        if not model_dir.is_dir() or is_shard_name(model_dir.name) or model_dir.path == str(MIX_DIR):
+            continue
+        for entry in os.scandir(model_dir.path):
+            # Half-written .tmp directories are left for the retention GC
+            if entry.is_dir() and not entry.name.endswith(".tmp"):
+                moved["stems"] += _move(Path(entry.path), stem_dir(entry.name, model_dir.name), dry_run)
+    if MIX_DIR.is_dir():
+        for entry in os.scandir(MIX_DIR):
+            if entry.is_dir() and not is_shard_name(entry.name):
+                moved["mixes"] += _move(Path(entry.path), mix_dir(entry.name), dry_run)
+    return moved
+
+
+if __name__ == "__main__":
+    # python -m app.chats.storage [--dry-run]  (run from the directory the API runs in, with the API stopped)
+    logging.basicConfig(level=logging.INFO)
+    moved = migrate_flat_layout(dry_run="--dry-run" in sys.argv[1:])
+    print(f"{'Would move' if '--dry-run' in sys.argv[1:] else 'Moved'} {moved['clips']} clips, "
+          f"{moved['stems']} stem directories and {moved['mixes']} mix directories into shards")
+    sys.exit(0)
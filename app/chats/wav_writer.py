@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import struct
+import sys
+import threading
+from pathlib import Path
+
+from .audio_sinks import AudioSink, CHANNELS, SAMPLE_WIDTH_BYTES, FRAME_RATE, BYTES_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+HEADER_SIZE = 44
+PARTIAL_SUFFIX = ".part"
+# <clip>.wav.<pid>.<thread>.part, so two sessions writing the same clip never share a file
+PARTIAL_PATTERN = re.compile(r"^(?P<name>.+?)(?:\.\d+\.\d+)?\.part$")
+
+
+def wav_header(data_bytes, channels=CHANNELS, sample_width=SAMPLE_WIDTH_BYTES, frame_rate=FRAME_RATE):
+    # Canonical 44-byte PCM RIFF header
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_bytes, b"WAVE",
+        b"fmt ", 16, 1, channels, frame_rate, frame_rate * block_align, block_align, sample_width * 8,
+        b"data", data_bytes,
+    )
+
+
+def partial_path(path):
+    path = Path(path)
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+
+
+def partial_target(name):
+    """File name a partial file is renamed to, e.g. `clip.wav` for `clip.wav.12.34.part`; None for other files."""
+    match = PARTIAL_PATTERN.match(name)
+    return match.group("name") if match else None
+
+
+class StreamingWavWriter:
+    """Appends PCM frames to `<path>.<pid>.<thread>.part` as they arrive instead of buffering the clip.
+
+    The RIFF header is patched every `patch_every` bytes so the partial file is always a
+    playable WAV up to the last patch, and `commit()` patches it one final time and
+    atomically renames the file into place.
+    """
+
+    def __init__(self, path, channels=CHANNELS, sample_width=SAMPLE_WIDTH_BYTES, frame_rate=FRAME_RATE,
+                 patch_every=BYTES_PER_SECOND):
+        self.path = Path(path)
+        self.temp_path = partial_path(self.path)
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_rate = frame_rate
+        self.patch_every = patch_every
+        self.data_bytes = 0
+        self._patched_bytes = 0
+        self.temp_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.temp_path, "wb")
+        self._file.write(wav_header(0, channels, sample_width, frame_rate))
+
+    def write(self, data):
+        self._file.write(data)
+        self.data_bytes += len(data)
+        if self.data_bytes - self._patched_bytes >= self.patch_every:
+            self._patch_header()
+
+    def _patch_header(self):
+        self._file.flush()
+        self._file.seek(0)
+        self._file.write(wav_header(self.data_bytes, self.channels, self.sample_width, self.frame_rate))
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+        self._patched_bytes = self.data_bytes
+
+    def close(self):
+        # Leaves a valid WAV at temp_path; commit() or abort() decides what happens to it
+        if self._file.closed:
+            return
+        self._patch_header()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def commit(self, path=None):
+        self.close()
+        final_path = Path(path) if path else self.path
+        os.replace(self.temp_path, final_path)
+        logger.debug(f"Committed {self.data_bytes} bytes of audio to {final_path}")
+        return final_path
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class WavFileSink(AudioSink):
+    """Headless sink that streams the clip straight to disk with StreamingWavWriter.
+
+    Memory per session stays constant, and if the process dies mid-session the
+    `.part` file can be recovered with recover_partial_wav().
+    """
+
+    def __init__(self, path, max_seconds=None):
+        self.path = Path(path)
+        self.max_bytes = int(max_seconds * BYTES_PER_SECOND) if max_seconds else None
+        self.writer = None
+
+    def open(self):
+        if self.writer is None:
+            self.writer = StreamingWavWriter(self.path)
+
+    def write(self, data):
+        if self.max_bytes is not None:
+            data = data[:self.max_bytes - self.writer.data_bytes]
+        self.writer.write(data)
+
+    @property
+    def full(self):
+        return self.max_bytes is not None and self.writer is not None and self.writer.data_bytes >= self.max_bytes
+
+    @property
+    def captured_bytes(self):
+        return self.writer.data_bytes if self.writer is not None else 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def save(self, path=None):
+        return self.writer.commit(path)
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.abort()
+
+
+def recover_partial_wav(temp_path):
+    """Fix up the header of an interrupted `.part` file and rename it to its final name."""
+    temp_path = Path(temp_path)
+    size = temp_path.stat().st_size
+    block_align = CHANNELS * SAMPLE_WIDTH_BYTES
+    data_bytes = max(0, size - HEADER_SIZE) // block_align * block_align
+    with open(temp_path, "r+b") as f:
+        f.truncate(HEADER_SIZE + data_bytes)
+        f.seek(0)
+        f.write(wav_header(data_bytes))
+    final_path = temp_path.with_name(partial_target(temp_path.name))
+    os.replace(temp_path, final_path)
+    logger.info(f"Recovered {data_bytes / BYTES_PER_SECOND:.1f}s of audio into {final_path}")
+    return final_path
+
+
+# python -m app.chats.wav_writer MusicDownloadFiles
+if __name__ == "__main__":
+    directory = Path(sys.argv[1]) if len(sys.argv) > 1 else Path.cwd() / "MusicDownloadFiles"
+    # Clips sit in two levels of shard directories (see storage.py); unmigrated ones directly in `directory`
+    for partial in [*directory.glob(f"*{PARTIAL_SUFFIX}"), *directory.glob(f"*/*/*{PARTIAL_SUFFIX}")]:
+        recover_partial_wav(partial)
@@ -0,0 +1,220 @@
+import logging
+import os
+import queue
+import sys
+import threading
+import wave
+
+import numpy as np
+
+from .. import db
+from ..models import ClipMetadata
+from .blob_store import blob_store
+from .mixer import decode_stem, MIX_SAMPLE_RATE
+from .storage import DOWNLOAD_DIR, clip_path, stem_dir, iter_shards
+
+logger = logging.getLogger(__name__)
+
+PEAKS_SUFFIX = ".peaks.npz"
+# Frames per min/max pair at each resolution; each level is 4x the previous so it is built from it
+PEAK_LEVELS = (256, 1024, 4096, 16384)
+DEFAULT_PEAK_LEVEL = 1024
+PEAK_BITS = 8
+PEAK_SCALE = 2 ** (PEAK_BITS - 1) - 1
+WAV_FULL_SCALE = 32768
+
+
+def peaks_path(source):
+    # clip.wav -> clip.peaks.npz, drums.mp3 -> drums.peaks.npz, next to the audio they describe
+    return os.path.splitext(str(source))[0] + PEAKS_SUFFIX
+
+
+def read_wav(path):
+    """Return a saved clip as a (frames, channels) int16 array and its sample rate."""
+    with wave.open(str(path), "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError(f"{path} is not 16-bit PCM")
+        frames = w.readframes(w.getnframes())
+        return np.frombuffer(frames, dtype="<i2").reshape(-1, w.getnchannels()), w.getframerate()
+
+
+def compute_peaks(samples, full_scale, levels=PEAK_LEVELS):
+    """Min/max pairs of `samples` (frames, channels) at each level, as (peaks, 2) int8 arrays.
+
+    The finest level reduces the PCM itself, over all channels at once; every coarser
+    level reduces the one before it, so the audio is only scanned once.
+    """
+    result = {}
+    low, high = samples.min(axis=1), samples.max(axis=1)
+    previous = 1
+    for level in levels:
+        if len(low):
+            starts = np.arange(0, len(low), level // previous)
+            low, high = np.minimum.reduceat(low, starts), np.maximum.reduceat(high, starts)
+        pairs = np.column_stack((low, high)).astype(np.float32) * (PEAK_SCALE / full_scale)
+        result[level] = np.clip(np.rint(pairs), -PEAK_SCALE, PEAK_SCALE).astype(np.int8)
+        previous = level
+    return result
+
+
+def write_peaks(path, peaks, sample_rate, frames):
+    # Written under a unique name and renamed, like the decoded stems
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            np.savez(f, sample_rate=sample_rate, frames=frames, **{f"level_{level}": data for level, data in peaks.items()})
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_peaks(path, width=None):
+    """The level of `path` best suited to drawing `width` pixels, in the audiowaveform JSON layout.
+
+    That is the coarsest level with at least `width` pairs (the finest one when none has
+    enough), or DEFAULT_PEAK_LEVEL without a width.
+    """
+    with np.load(path) as stored:
+        levels = sorted(int(name[len("level_"):]) for name in stored.files if name.startswith("level_"))
+        level = DEFAULT_PEAK_LEVEL if DEFAULT_PEAK_LEVEL in levels else levels[0]
+        if width:
+            fitting = [l for l in levels if len(stored[f"level_{l}"]) >= width]
+            level = fitting[-1] if fitting else levels[0]
+        data = stored[f"level_{level}"]
+        sample_rate, frames = int(stored["sample_rate"]), int(stored["frames"])
+    return {
+        "version": 2,
+        "channels": 1,
+        "sample_rate": sample_rate,
+        "samples_per_pixel": level,
+        "bits": PEAK_BITS,
+        "length": len(data),
+        "duration": round(frames / sample_rate, 3),
+        "data": data.ravel().tolist(),
+    }
+
+
+class WaveformPeaks:
+    """Multi-resolution waveform peaks of every clip and stem, stored as `<name>.peaks.npz`.
+
+    Computed on a background thread as soon as a clip is saved or its stems land, so the
+    library and the mixer can draw waveforms without downloading the audio. The clip's
+    duration also goes into `clip_metadata` for `/all-audios`. Peaks missing or older
+    than their audio (re-rendered clips, re-separated stems) are computed on request.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._computed = 0
+        self._failed = 0
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["waveform_peaks"] = self
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="waveform-peaks", daemon=True)
+                self._worker.start()
+
+    def enqueue(self, link, stems=()):
+        """Queue the clip's peaks, or with `stems` those of the named stems."""
+        self._start()
+        self._queue.put((link, tuple(stems)))
+
+    def _run(self):
+        while True:
+            link, stems = self._queue.get()
+            try:
+                for source in ([stem_dir(link) / f"{stem}.mp3" for stem in stems] if stems else [clip_path(link)]):
+                    path, _ = self._compute(link, source)
+                    blob_store.upload(path)
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error(f"Failed to compute waveform peaks for {link}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _compute(self, link, source):
+        # Returns (path, whether it had to be computed now)
+        path = peaks_path(source)
+        try:
+            if os.stat(path).st_mtime_ns >= os.stat(source).st_mtime_ns:
+                return path, False
+        except FileNotFoundError:
+            pass
+        if str(source).endswith(".wav"):
+            samples, sample_rate = read_wav(source)
+            full_scale = WAV_FULL_SCALE
+        else:
+            samples, sample_rate, full_scale = decode_stem(source), MIX_SAMPLE_RATE, 1.0
+        write_peaks(path, compute_peaks(samples, full_scale), sample_rate, len(samples))
+        if str(source).endswith(".wav"):
+            self._record(link, len(samples) / sample_rate, sample_rate, samples.shape[1])
+        with self._lock:
+            self._computed += 1
+        logger.debug(f"Computed waveform peaks of {source}")
+        return path, True
+
+    def _record(self, link, duration, sample_rate, channels):
+        with self.app.app_context():
+            try:
+                db.session.merge(ClipMetadata(link=link, duration=round(duration, 3), sample_rate=sample_rate, channels=channels))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def path_for(self, link, stem=None):
+        """Local path of the peaks of the clip (or one of its stems), computing them if needed.
+
+        Raises FileNotFoundError when the audio itself doesn't exist.
+        """
+        source = clip_path(link) if stem is None else stem_dir(link) / f"{stem}.mp3"
+        path = peaks_path(source)
+        # Computed on another node: its stored copy is as good as a local one
+        if not os.path.exists(source) and blob_store.fetch(path):
+            return path
+        if not blob_store.fetch(source):
+            raise FileNotFoundError(source)
+        return self._compute(link, source)[0]
+
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._queue.qsize(), "computed": self._computed, "failed": self._failed}
+
+
+waveform_peaks = WaveformPeaks()
+
+
+def backfill():
+    """Compute peaks and metadata of clips saved before peaks existed; stems get theirs on request."""
+    computed = 0
+    for shard_dir in iter_shards(DOWNLOAD_DIR):
+        for name in sorted(os.listdir(shard_dir)):
+            if name.endswith(".wav"):
+                computed += waveform_peaks._compute(name[:-len(".wav")], os.path.join(shard_dir, name))[1]
+    return computed
+
+
+if __name__ == "__main__":
+    # python -m app.chats.waveforms  (run from the directory the API runs in)
+    from app import create_app
+    # Through the package, so this uses the instance create_app() initialised rather than this module's copy
+    from app.chats.waveforms import backfill
+
+    create_app()
+    print(f"Computed waveform peaks for {backfill()} clips")
+    sys.exit(0)
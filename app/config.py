@@ -12,4 +12,62 @@ class Config:
     GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
     # GitHub OAuth
     GITHUB_CLIENT_ID = os.getenv('GITHUB_CLIENT_ID')
-    GITHUB_CLIENT_SECRET = os.getenv('GITHUB_CLIENT_SECRET')
\ No newline at end of file
+    GITHUB_CLIENT_SECRET = os.getenv('GITHUB_CLIENT_SECRET')
+    # Lyria generation executor: concurrent sessions and queued requests per process
+    GENERATION_MAX_WORKERS = int(os.getenv('GENERATION_MAX_WORKERS', 4))
+    GENERATION_MAX_PENDING = int(os.getenv('GENERATION_MAX_PENDING', 32))
+    # 'threads' (an event loop per generation) or 'asyncio' (one shared loop; asgi.py sets this)
+    GENERATION_EXECUTOR = os.getenv('GENERATION_EXECUTOR', 'threads')
+    # Threads serving Flask requests under asgi.py
+    ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+    # Reuse of identical (prompt, bpm, key) renders: 'fresh' (off), 'ttl' (everyone) or 'anonymous'
+    GENERATION_CACHE_POLICY = os.getenv('GENERATION_CACHE_POLICY', 'fresh')
+    GENERATION_CACHE_TTL_HOURS = float(os.getenv('GENERATION_CACHE_TTL_HOURS', 24))
+    GENERATION_CACHE_MAX_ENTRIES = int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', 500))
+    GENERATION_CACHE_MAX_BYTES = int(os.getenv('GENERATION_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+    # Long-lived Demucs service (separator.py --serve); started on first use if nothing listens there
+    SEPARATION_SERVICE_ADDRESS = os.getenv('SEPARATION_SERVICE_ADDRESS', '127.0.0.1:6123')
+    SEPARATION_AUTHKEY = os.getenv('SEPARATION_AUTHKEY')
+    DEMUCS_PYTHON = os.getenv('DEMUCS_PYTHON')
+    # Separations running at once (one service per slot, on consecutive ports) and torch threads per job
+    SEPARATION_MAX_PARALLEL = int(os.getenv('SEPARATION_MAX_PARALLEL', 1))
+    SEPARATION_TORCH_THREADS = int(os.getenv('SEPARATION_TORCH_THREADS', 0)) or None
+    # Memory-mapped decoded stems (.f32.npy next to each MP3) kept open by the mixer
+    STEM_CACHE_MAX_BYTES = int(os.getenv('STEM_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+    # Rendered mixes under separated_music/mixes, least recently served evicted past this size
+    MIX_CACHE_MAX_BYTES = int(os.getenv('MIX_CACHE_MAX_BYTES', 1024 ** 3))
+    # Keyset-paginated listings (/chat, /getmessages, /all-audios): default and largest ?limit=
+    LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 50))
+    LIST_MAX_PAGE_SIZE = int(os.getenv('LIST_MAX_PAGE_SIZE', 200))
+    # How long POST /talk remembers an Idempotency-Key and replays its result
+    IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    # Retention GC: how often it runs (0 disables the background pass), anonymous clip and mix TTLs,
+    # grace period before unreferenced files count as orphans, per-user quota and global watermarks (0 disables)
+    # Only one process per storage directory needs the GC thread; set RETENTION_ENABLED=false on the others
+    RETENTION_ENABLED = os.getenv('RETENTION_ENABLED', 'true').lower() == 'true'
+    GC_INTERVAL_MINUTES = float(os.getenv('GC_INTERVAL_MINUTES', 30))
+    GC_ANONYMOUS_TTL_HOURS = float(os.getenv('GC_ANONYMOUS_TTL_HOURS', 24))
+    GC_MIX_TTL_HOURS = float(os.getenv('GC_MIX_TTL_HOURS', 168))
+    GC_ORPHAN_GRACE_HOURS = float(os.getenv('GC_ORPHAN_GRACE_HOURS', 1))
+    GC_STALE_JOB_HOURS = float(os.getenv('GC_STALE_JOB_HOURS', 6))
+    GC_USER_QUOTA_BYTES = int(os.getenv('GC_USER_QUOTA_BYTES', 2 * 1024 ** 3))
+    GC_HIGH_WATERMARK_BYTES = int(os.getenv('GC_HIGH_WATERMARK_BYTES', 20 * 1024 ** 3))
+    GC_LOW_WATERMARK_BYTES = int(os.getenv('GC_LOW_WATERMARK_BYTES', 16 * 1024 ** 3))
+    # Shared store for clips and stems: 'local' (files under BLOB_STORE_ROOT, default the working directory) or 's3'
+    BLOB_STORE = os.getenv('BLOB_STORE', 'local')
+    BLOB_STORE_ROOT = os.getenv('BLOB_STORE_ROOT')
+    BLOB_STORE_BUCKET = os.getenv('BLOB_STORE_BUCKET')
+    BLOB_STORE_PREFIX = os.getenv('BLOB_STORE_PREFIX', '')
+    BLOB_STORE_ENDPOINT_URL = os.getenv('BLOB_STORE_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+    BLOB_STORE_REGION = os.getenv('BLOB_STORE_REGION')
+    # Files this node doesn't have are redirected to a presigned URL valid this long, instead of being proxied
+    BLOB_STORE_REDIRECT_DOWNLOADS = os.getenv('BLOB_STORE_REDIRECT_DOWNLOADS', 'true').lower() == 'true'
+    BLOB_STORE_URL_EXPIRY_SECONDS = int(os.getenv('BLOB_STORE_URL_EXPIRY_SECONDS', 3600))
+    # Compressed copies encoded in the background after each clip is saved (wav, flac, opus, aac, mp3);
+    # other formats are transcoded on first request and cached
+    CLIP_STORED_FORMATS = [name.strip() for name in os.getenv('CLIP_STORED_FORMATS', 'flac,opus').split(',') if name.strip()]
+    # Google ID token signing certs; point at a stand-in server for local testing
+    GOOGLE_CERTS_URL = os.getenv('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+    # Users and chat owners resolved for authorization are cached this long per process
+    IDENTITY_CACHE_TTL_SECONDS = int(os.getenv('IDENTITY_CACHE_TTL_SECONDS', 30))
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv('IDENTITY_CACHE_MAX_ENTRIES', 10000))
\ No newline at end of file
@@ -0,0 +1,163 @@
+import json
+import logging
+import re
+import threading
+import time
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth import jwt as google_jwt
+from google.auth import transport
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token as google_id_token
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+# Used when the certs response doesn't say how long it may be kept
+DEFAULT_CERTS_TTL_SECONDS = 300
+# A key id still missing after a refresh doesn't trigger another one for this long (made-up kids)
+MIN_REFRESH_SECONDS = 60
+MAX_UNKNOWN_KIDS = 1000
+# A failed refresh keeps serving the previous certs for this long before trying again
+STALE_RETRY_SECONDS = 30
+CERTS_TIMEOUT_SECONDS = 5
+POOL_SIZE = 10
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+def cache_ttl(headers):
+    """Seconds a response may be cached for, from its Cache-Control max-age minus its Age."""
+    cache_control = headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if match is None:
+        return DEFAULT_CERTS_TTL_SECONDS
+    try:
+        age = int(headers.get("Age", 0))
+    except ValueError:
+        age = 0
+    return max(0, int(match.group(1)) - age)
+
+
+class _CachedResponse(transport.Response):
+    def __init__(self, status, headers, data):
+        self._status = status
+        self._headers = headers
+        self._data = data
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @property
+    def data(self):
+        return self._data
+
+
+class GoogleCertCache:
+    """Verifies Google ID tokens locally against signing certs fetched once per their max-age.
+
+    The instance is the google-auth transport handed to `verify_token`: requests for the
+    certs URL are answered from the cache, everything goes over one pooled session, and
+    only one request thread fetches when the cache expires. `GOOGLE_CERTS_URL` can point
+    at a stand-in server serving `{kid: PEM}` or a JWKS, e.g. for local testing.
+    """
+
+    def __init__(self):
+        self.certs_url = GOOGLE_CERTS_URL
+        self.client_id = None
+        self._transport = None
+        self._lock = threading.Lock()
+        self._response = None
+        self._fetched = 0
+        self._expires = 0
+        self._unknown_kids = {}
+        self._fetches = 0
+        self._hits = 0
+        self._failures = 0
+
+    def init_app(self, app):
+        self.certs_url = app.config.get("GOOGLE_CERTS_URL") or GOOGLE_CERTS_URL
+        self.client_id = app.config.get("GOOGLE_CLIENT_ID")
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._transport = google_requests.Request(session=session)
+        app.extensions["google_certs"] = self
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        if url != self.certs_url or method != "GET":
+            return self._transport(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+        with self._lock:
+            if self._response is not None and time.monotonic() < self._expires:
+                self._hits += 1
+                return self._response
+            self._refresh()
+            return self._response
+
+    def _refresh(self):
+        # Called with the lock held, so concurrent logins wait for this one fetch
+        try:
+            response = self._transport(self.certs_url, method="GET", timeout=CERTS_TIMEOUT_SECONDS)
+            if response.status != 200:
+                raise ValueError(f"Could not fetch certificates at {self.certs_url}: HTTP {response.status}")
+        except Exception as e:
+            self._failures += 1
+            if self._response is None:
+                raise
+            logger.warning(f"Keeping cached Google certs, refresh failed: {e}")
+            self._expires = time.monotonic() + STALE_RETRY_SECONDS
+            return
+        self._response = _CachedResponse(response.status, dict(response.headers), response.data)
+        self._fetched = time.monotonic()
+        self._expires = self._fetched + cache_ttl(response.headers)
+        self._fetches += 1
+        logger.info(f"Fetched Google certs, cached for {self._expires - self._fetched:.0f}s")
+
+    def _knows(self, kid):
+        certs = json.loads(self(self.certs_url).data.decode("utf-8"))
+        return kid in ({key.get("kid") for key in certs["keys"]} if "keys" in certs else certs)
+
+    def verify(self, token):
+        """Decode and verify a Google ID token for this app's client id; raises ValueError when it's invalid."""
+        kid = google_jwt.decode_header(token).get("kid")
+        started = time.monotonic()
+        if not self._knows(kid):
+            # Google rotated its keys before our copy expired: fetch them again, unless another login
+            # just did or this kid was missing from a fresh copy a moment ago
+            with self._lock:
+                missing_since = self._unknown_kids.get(kid)
+                if self._fetched < started and (missing_since is None or started - missing_since >= MIN_REFRESH_SECONDS):
+                    self._refresh()
+            if not self._knows(kid):
+                with self._lock:
+                    if len(self._unknown_kids) >= MAX_UNKNOWN_KIDS:
+                        self._unknown_kids.clear()
+                    self._unknown_kids[kid] = time.monotonic()
+                raise ValueError(f"Token signed with an unknown key {kid!r}")
+        try:
+            return google_id_token.verify_token(token, self, self.client_id, certs_url=self.certs_url)
+        except jwt.PyJWTError as e:
+            # JWKS certs are checked by PyJWT, whose errors (unknown kid, expired, wrong audience) aren't ValueErrors
+            raise ValueError(f"Invalid token: {e}") from e
+
+    def stats(self):
+        with self._lock:
+            return {
+                "certs_url": self.certs_url,
+                "fetches": self._fetches,
+                "hits": self._hits,
+                "failures": self._failures,
+                "expires_in": max(0, round(self._expires - time.monotonic())) if self._response else 0,
+            }
+
+
+google_certs = GoogleCertCache()
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from . import db
+from .models import Chat, User
+
+logger = logging.getLogger(__name__)
+
+
+class CachedUser(namedtuple("CachedUser", "id username email")):
+    """The columns of a User that requests need, detached from any session."""
+
+    def to_dict(self):
+        return {"id": self.id, "username": self.username, "email": self.email}
+
+
+def _key(value):
+    # Identities arrive as JWT subjects (strings), chat ids as URL parts or JSON values
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _TTLCache:
+    def __init__(self):
+        self.ttl = 30
+        self.max_entries = 10_000
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+
+class IdentityCache:
+    """Short-lived in-process cache of users and chat owners for authorization checks.
+
+    flask_jwt_extended's user loader resolves every token's user through it, and the chat
+    routes check ownership with `chat_owner`, so a user browsing their chats costs no
+    lookups after the first. Misses are not cached, so new users and chats show up at once.
+    Chats created or deleted here update the cache; other processes see it within `ttl` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = _TTLCache()
+        self._owners = _TTLCache()
+
+    def init_app(self, app):
+        for cache in (self._users, self._owners):
+            cache.ttl = app.config.get("IDENTITY_CACHE_TTL_SECONDS", cache.ttl)
+            cache.max_entries = app.config.get("IDENTITY_CACHE_MAX_ENTRIES", cache.max_entries)
+        app.extensions["identity_cache"] = self
+
+    def _lookup(self, cache, key, load):
+        if key is None:
+            return None
+        with self._lock:
+            value = cache.get(key)
+        if value is not None:
+            return value
+        value = load(key)
+        if value is not None:
+            with self._lock:
+                cache.put(key, value)
+        return value
+
+    def user(self, user_id):
+        """The CachedUser for a JWT identity, or None when there is no such user."""
+        def load(key):
+            row = db.session.query(User.id, User.username, User.email).filter(User.id == key).first()
+            return CachedUser(*row) if row else None
+        return self._lookup(self._users, _key(user_id), load)
+
+    def chat_owner(self, chat_id):
+        """The user id owning the chat, or None when it doesn't exist."""
+        return self._lookup(self._owners, _key(chat_id),
+                            lambda key: db.session.query(Chat.user_id).filter(Chat.id == key).scalar())
+
+    def remember_chat(self, chat_id, user_id):
+        with self._lock:
+            self._owners.put(_key(chat_id), user_id)
+
+    def forget_chat(self, chat_id):
+        with self._lock:
+            self._owners.pop(_key(chat_id))
+
+
+identity_cache = IdentityCache()
@@ -1,6 +1,6 @@
 from . import db
 from datetime import datetime
-import os
+import hashlib
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import Session
 
@@ -26,11 +26,13 @@ class User(db.Model):
 
 class Chat(db.Model):
     __tablename__ = 'conversations'
+    # A user's chat list, newest or oldest first
+    __table_args__ = (db.Index('ix_conversations_user_id_time', 'user_id', 'time'),)
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(80), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('otteruser.id'), nullable=False)
     folder_id = db.Column(db.Integer, db.ForeignKey('folder.id'), nullable=True)
-    messages = db.relationship('Messages', backref='convo_obj', cascade='all, delete-orphan')
+    messages = db.relationship('Messages', backref='convo_obj', cascade='all, delete-orphan', passive_deletes=True)
     time = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -44,10 +46,12 @@ class Chat(db.Model):
 
 class Messages(db.Model):
     __tablename__ = 'messages'
+    # A chat's messages in order
+    __table_args__ = (db.Index('ix_messages_convo_time', 'convo', 'time'),)
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(20), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    convo = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    convo = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
     time = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
@@ -62,41 +66,126 @@ class Messages(db.Model):
 class Audios(db.Model):
     __tablename__ = 'audios'
     id = db.Column(db.Integer, primary_key=True)
-    link = db.Column(db.String(255), nullable=False)
-    chat = db.Column(db.Integer, db.ForeignKey("conversations.id"))
-    prompt = db.Column(db.Integer, db.ForeignKey("messages.id"))
-    chat_rel = db.relationship("Chat", backref="audios")
-    prompt_rel = db.relationship("Messages", backref="audios")
+    link = db.Column(db.String(255), nullable=False, index=True)
+    chat = db.Column(db.Integer, db.ForeignKey("conversations.id", ondelete='CASCADE'), index=True)
+    prompt = db.Column(db.Integer, db.ForeignKey("messages.id", ondelete='CASCADE'), index=True)
+    chat_rel = db.relationship("Chat", backref=db.backref("audios", passive_deletes=True))
+    prompt_rel = db.relationship("Messages", backref=db.backref("audios", passive_deletes=True))
+
+class Jobs(db.Model):
+    # Lifecycle of one generated clip: queued -> generating -> saved -> separating -> stems_ready (or failed)
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    link = db.Column(db.String(255), unique=True, nullable=False)
+    audio = db.Column(db.Integer, db.ForeignKey("audios.id", ondelete='CASCADE'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    audio_rel = db.relationship("Audios", backref=db.backref("jobs", cascade="all, delete-orphan", passive_deletes=True))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "link": self.link,
+            "audio": self.audio,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created.isoformat() if self.created else None,
+            "updated": self.updated.isoformat() if self.updated else None
+        }
+
+class CachedClips(db.Model):
+    # Rendered clips that can be reused for identical (prompt, bpm, key) requests
+    __tablename__ = 'cached_clips'
+    fingerprint = db.Column(db.String(64), primary_key=True)
+    source_link = db.Column(db.String(255), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    bpm = db.Column(db.Integer, nullable=True)
+    key = db.Column(db.String(64), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StemManifest(db.Model):
+    # Finished stems of one clip, written when its separation completes; the mixer reads this instead of the disk
+    __tablename__ = 'stem_manifests'
+    link = db.Column(db.String(255), primary_key=True)
+    model = db.Column(db.String(64), nullable=False)
+    stems = db.Column(db.JSON, nullable=False)  # [{"name", "size", "duration", "sha256"}, ...]
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def names(self):
+        return [stem["name"] for stem in self.stems]
+
+    @property
+    def version(self):
+        # Changes whenever any stem's content does
+        return hashlib.sha256("".join(stem["sha256"] for stem in self.stems).encode()).hexdigest()[:12]
+
+    def to_dict(self):
+        return {
+            "link": self.link,
+            "model": self.model,
+            "stems": self.stems,
+            "created": self.created.isoformat() if self.created else None
+        }
+
+class ClipMetadata(db.Model):
+    # Measured once a clip is saved (see waveforms.py), so listings don't have to open the audio
+    __tablename__ = 'clip_metadata'
+    link = db.Column(db.String(255), primary_key=True)
+    duration = db.Column(db.Float, nullable=False)
+    sample_rate = db.Column(db.Integer, nullable=False)
+    channels = db.Column(db.Integer, nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+class IdempotencyKeys(db.Model):
+    # What POST /talk created for a user's Idempotency-Key, so a retried request gets the same ids back
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_id_key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('otteruser.id', ondelete='CASCADE'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    chat = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    message = db.Column(db.Integer, db.ForeignKey('messages.id', ondelete='CASCADE'), nullable=False)
+    new_chat = db.Column(db.Boolean, nullable=False, default=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Folder(db.Model):
     __tablename__ = 'folder'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(80), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('otteruser.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('otteruser.id', ondelete='CASCADE'), nullable=False, index=True)
 
-def delete_audio_files_for_prompt(prompt_id: int, audio_dir="MusicDownloadFiles"):
-    deleted = 0
-    for filename in os.listdir(audio_dir):
-        if filename.endswith(f"_{prompt_id}.wav"):
-            file_path = os.path.join(audio_dir, filename)
-            os.remove(file_path)
-            print(f"Deleted audio file: {file_path}")
-            deleted += 1
-    if deleted == 0:
-        print(f"No audio files found for prompt {prompt_id}")
-    return deleted
-
-def delete_prompt_from_db(db: Session, prompt_id: int):
-    prompt = db.query(Messages).filter(Messages.id == prompt_id).first()
-    if prompt:
-        db.delete(prompt)
-        db.commit()
-        print(f"Deleted prompt {prompt_id} from database")
-        return True
-    else:
-        print(f"Prompt {prompt_id} not found in database")
-        return False
+def delete_audio_rows(db: Session, condition):
+    # Set-based: one DELETE per table, driven by the audio links; returns the links so their files can be removed
+    links = [link for (link,) in db.query(Audios.link).filter(condition)]
+    if links:
+        db.query(Jobs).filter(Jobs.link.in_(links)).delete(synchronize_session=False)
+        db.query(StemManifest).filter(StemManifest.link.in_(links)).delete(synchronize_session=False)
+        db.query(ClipMetadata).filter(ClipMetadata.link.in_(links)).delete(synchronize_session=False)
+    db.query(Audios).filter(condition).delete(synchronize_session=False)
+    return links
+
+def delete_chat_rows(db: Session, chat_id: int):
+    # Issued explicitly instead of relying on ON DELETE CASCADE, which SQLite only honours with foreign_keys=ON
+    links = delete_audio_rows(db, Audios.chat == chat_id)
+    db.query(IdempotencyKeys).filter(IdempotencyKeys.chat == chat_id).delete(synchronize_session=False)
+    db.query(Messages).filter(Messages.convo == chat_id).delete(synchronize_session=False)
+    db.query(Chat).filter(Chat.id == chat_id).delete(synchronize_session=False)
+    return links
 
 def delete_prompt_and_audio(db: Session, prompt_id: int):
-    if delete_prompt_from_db(db, prompt_id):
-        delete_audio_files_for_prompt(prompt_id)
\ No newline at end of file
+    """Delete a prompt and its audio rows; returns the deleted audio links, or None if there was no such prompt."""
+    if db.query(Messages.id).filter(Messages.id == prompt_id).scalar() is None:
+        print(f"Prompt {prompt_id} not found in database")
+        return None
+    links = delete_audio_rows(db, Audios.prompt == prompt_id)
+    db.query(IdempotencyKeys).filter(IdempotencyKeys.message == prompt_id).delete(synchronize_session=False)
+    db.query(Messages).filter(Messages.id == prompt_id).delete(synchronize_session=False)
+    db.commit()
+    print(f"Deleted prompt {prompt_id} from database")
+    return links
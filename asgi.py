@@ -0,0 +1,34 @@
+"""ASGI entry point: one event loop per worker process hosts every Lyria session.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+Flask views still run synchronously, on a pool of ASGI_WSGI_THREADS threads, but
+generations are handed to the server's event loop as tasks (GENERATION_EXECUTOR=asyncio),
+so concurrent sessions cost coroutines instead of threads.
+"""
+import asyncio
+import os
+
+from a2wsgi import WSGIMiddleware
+
+os.environ.setdefault("GENERATION_EXECUTOR", "asyncio")
+
+from app import create_app, generation_executor
+
+app = create_app()
+# asgiref's WsgiToAsgi would run every request on one thread; long-polls and streams need a pool
+wsgi = WSGIMiddleware(app, workers=app.config["ASGI_WSGI_THREADS"])
+
+
+async def application(scope, receive, send):
+    if scope["type"] != "lifespan":
+        return await wsgi(scope, receive, send)
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if app.config["GENERATION_EXECUTOR"] == "asyncio":
+                generation_executor.attach_loop(asyncio.get_running_loop())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,130 @@
+"""Time POST /google against a local stand-in for Google's signing certs endpoint.
+
+    python benchmarks/google_login_benchmark.py --database-url sqlite:////tmp/otter_login.db
+    python benchmarks/google_login_benchmark.py --latency-ms 150 --logins 200
+
+A JWKS server with a freshly generated RSA key runs on localhost, answering after
+`--latency-ms` like a real round trip to Google, and ID tokens are minted with that key.
+Each login is first verified the old way (a new transport and a certs download per
+token) and then through the API, which uses the shared cert cache. The database is
+dropped and re-created, so never point this at a real one.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+KEY_ID = "benchmark-key"
+CLIENT_ID = "benchmark-client.apps.googleusercontent.com"
+CERTS_MAX_AGE = 3600
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:////tmp/otter_login.db")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20, help="distinct Google accounts the logins cycle through")
+    parser.add_argument("--latency-ms", type=float, default=100, help="simulated round trip to the certs endpoint")
+    return parser.parse_args()
+
+
+def start_certs_server(private_key, latency):
+    """Serve the key as a JWKS with a Cache-Control max-age, like Google's v3 certs endpoint."""
+    from jwt.algorithms import RSAAlgorithm
+
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    body = json.dumps({"keys": [dict(jwk, kid=KEY_ID, use="sig", alg="RS256")]}).encode()
+    requests_served = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            requests_served.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", f"public, max-age={CERTS_MAX_AGE}, must-revalidate")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/oauth2/v3/certs", requests_served
+
+
+def mint_tokens(private_key, users):
+    from google.auth import crypt, jwt
+
+    pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    signer = crypt.RSASigner.from_string(pem, key_id=KEY_ID)
+    now = int(time.time())
+    return [jwt.encode(signer, {
+        "iss": "https://accounts.google.com",
+        "aud": CLIENT_ID,
+        "sub": str(100000 + u),
+        "email": f"user{u}@example.com",
+        "name": f"user{u}",
+        "iat": now,
+        "exp": now + 3600,
+    }).decode() for u in range(users)]
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    args = parse_args()
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    certs_url, served = start_certs_server(private_key, args.latency_ms / 1000)
+    tokens = mint_tokens(private_key, args.users)
+    os.environ.update(DATABASE_URL=args.database_url, GOOGLE_CERTS_URL=certs_url, GOOGLE_CLIENT_ID=CLIENT_ID)
+    from google.auth.transport import requests as google_requests
+    from google.oauth2 import id_token as google_id_token
+    from app import create_app, db
+    from app.google_certs import google_certs
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    client = app.test_client()
+
+    uncached = []
+    for i in range(args.logins):
+        started = time.perf_counter()
+        google_id_token.verify_token(tokens[i % len(tokens)], google_requests.Request(), CLIENT_ID, certs_url=certs_url)
+        uncached.append((time.perf_counter() - started) * 1000)
+    fetched_before = len(served)
+
+    cached = []
+    for i in range(args.logins):
+        started = time.perf_counter()
+        response = client.post("/google", json={"id_token": tokens[i % len(tokens)]})
+        cached.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            sys.exit(f"Login failed: {response.status_code} {response.get_json()}")
+
+    print(f"{'verification':<32}{'p50':>10}{'p99':>10}{'cert fetches':>14}  (ms)")
+    print(f"{'fresh transport per token':<32}{percentiles(uncached)[0]:>10.2f}{percentiles(uncached)[1]:>10.2f}{fetched_before:>14}")
+    print(f"{'POST /google, cached certs':<32}{percentiles(cached)[0]:>10.2f}{percentiles(cached)[1]:>10.2f}"
+          f"{len(served) - fetched_before:>14}")
+    print(google_certs.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Seed a chat/message/audio dataset and time the API's hot queries with and without indexes.
+
+    python benchmarks/query_benchmark.py --database-url sqlite:////tmp/otter_bench.db
+    python benchmarks/query_benchmark.py --database-url postgresql://localhost/otter_bench --users 100000
+
+The database is dropped and re-created, so never point this at a real one. Each query
+is run against randomly chosen users/chats, first with the secondary indexes from
+app/models.py dropped and then with them created, and p50/p99 latencies are printed.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BATCH_SIZE = 10_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite:////tmp/otter_bench.db")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--chats-per-user", type=int, default=5)
+    parser.add_argument("--messages-per-chat", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=500, help="timed runs per query and phase")
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def insert_batches(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            db.session.execute(db.insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(model), batch)
+    db.session.commit()
+
+
+def seed(db, models, args):
+    User, Folder, Chat, Messages, Audios = models
+    start = datetime(2025, 1, 1)
+    users = args.users
+    chats = users * args.chats_per_user
+    print(f"Seeding {users} users, {chats} chats, {chats * args.messages_per_chat} messages, {chats} audios")
+    started = time.monotonic()
+    insert_batches(db, User, ({"id": u, "username": f"user{u}", "email": f"user{u}@example.com"}
+                              for u in range(1, users + 1)))
+    insert_batches(db, Folder, ({"id": u, "title": f"folder{u}", "user_id": u} for u in range(1, users + 1)))
+    # Chats are spread over users round-robin so each user's rows are interleaved with everyone else's,
+    # like a table filled over time by concurrent users
+    insert_batches(db, Chat, ({"id": c, "title": f"Chat {c}", "user_id": (c - 1) % users + 1,
+                               "time": start + timedelta(seconds=c)} for c in range(1, chats + 1)))
+    message_id = iter(range(1, chats * args.messages_per_chat + 1))
+    insert_batches(db, Messages, ({"id": next(message_id), "role": "user" if m % 2 == 0 else "assistant",
+                                   "content": f"lofi beat number {c}-{m}", "convo": (c - 1) % chats + 1,
+                                   "time": start + timedelta(seconds=c, milliseconds=m)}
+                                  for m in range(args.messages_per_chat) for c in range(1, chats + 1)))
+    insert_batches(db, Audios, ({"id": c, "link": f"lyria_{c}_{c}", "chat": c, "prompt": c}
+                                for c in range(1, chats + 1)))
+    print(f"Seeded in {time.monotonic() - started:.1f}s")
+
+
+def hot_queries(db, models, args, rng):
+    User, Folder, Chat, Messages, Audios = models
+    chats = args.users * args.chats_per_user
+    messages = chats * args.messages_per_chat
+    # Same statements the endpoints issue (get_chats, get_messages, get_audios, delete prompt, folders)
+    return {
+        "chats by user": lambda: Chat.query.filter_by(user_id=rng.randint(1, args.users)).all(),
+        "messages by chat": lambda: db.session.get(Chat, rng.randint(1, chats)).messages,
+        "audios by user": lambda: Audios.query.join(Chat).filter(Chat.id == Audios.chat, Chat.user_id == rng.randint(1, args.users)).all(),
+        "message by id": lambda: Messages.query.filter(Messages.id == rng.randint(1, messages)).first(),
+        "folders by user": lambda: Folder.query.filter_by(user_id=rng.randint(1, args.users)).all(),
+    }
+
+
+def run_phase(db, queries, iterations):
+    results = {}
+    for name, query in queries.items():
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+            # Start every run from a clean session so the identity map doesn't answer from memory
+            db.session.rollback()
+            db.session.expunge_all()
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))])
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_URL"] = args.database_url
+    from app import create_app, db
+    from app.models import User, Folder, Chat, Messages, Audios
+    models = (User, Folder, Chat, Messages, Audios)
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(db, models, args)
+        indexes = [index for model in models for index in model.__table__.indexes]
+        rng = random.Random(args.seed)
+        queries = hot_queries(db, models, args, rng)
+
+        for index in indexes:
+            index.drop(bind=db.engine, checkfirst=True)
+        rng.seed(args.seed)
+        before = run_phase(db, queries, args.iterations)
+        for index in indexes:
+            index.create(bind=db.engine, checkfirst=True)
+        rng.seed(args.seed)
+        after = run_phase(db, queries, args.iterations)
+
+    print(f"\nIndexes: {', '.join(index.name for index in indexes)}")
+    print(f"{'query':<20}{'p50 before':>12}{'p99 before':>12}{'p50 after':>12}{'p99 after':>12}  (ms)")
+    for name in queries:
+        print(f"{name:<20}{before[name][0]:>12.3f}{before[name][1]:>12.3f}{after[name][0]:>12.3f}{after[name][1]:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,11 @@
 import asyncio
 import os
-import wave
 from dotenv import load_dotenv
 from google.genai import types
 
 from MusicSessionController import MusicSessionController
 from utils import ask_to_download
 
-CHANNELS = 2
-SAMPLE_WIDTH_BYTES = 2
-FRAME_RATE = 48_000
 MODEL = "models/lyria-realtime-exp"
 
 async def main():
@@ -59,16 +55,14 @@ async def main():
 
         save, path = ask_to_download()
         if save:
-            if controller.pcm_buffer:
-                with wave.open(str(path), "wb") as w:
-                    w.setnchannels(CHANNELS)
-                    w.setsampwidth(SAMPLE_WIDTH_BYTES)
-                    w.setframerate(FRAME_RATE)
-                    w.writeframes(controller.pcm_buffer)
+            if controller.recorder.captured_bytes:
+                controller.recorder.save(path)
                 print(f"Saved ✔️  {path}")
             else:
+                controller.recorder.discard()
                 print("No audio captured—nothing to save.")
         else:
+            controller.recorder.discard()
             print("Clip discarded.")
 
 if __name__ == "__main__":
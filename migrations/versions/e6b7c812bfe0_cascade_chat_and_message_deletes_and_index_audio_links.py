@@ -0,0 +1,54 @@
+"""Cascade chat and message deletes and index audio links
+
+Revision ID: e6b7c812bfe0
+Revises: 6e8a0f50d7ec
+Create Date: 2026-10-18 21:43:27.081980
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# PostgreSQL's names for the unnamed constraints of the earlier revisions; SQLite batch mode
+# reflects its unnamed ones under the same names
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b7c812bfe0'
+down_revision = '6e8a0f50d7ec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('audios', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audios_link'), ['link'], unique=False)
+        batch_op.drop_constraint('audios_chat_fkey', type_='foreignkey')
+        batch_op.drop_constraint('audios_prompt_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('audios_chat_fkey', 'conversations', ['chat'], ['id'], ondelete='CASCADE')
+        batch_op.create_foreign_key('audios_prompt_fkey', 'messages', ['prompt'], ['id'], ondelete='CASCADE')
+
+    with op.batch_alter_table('jobs', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('jobs_audio_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('jobs_audio_fkey', 'audios', ['audio'], ['id'], ondelete='CASCADE')
+
+    with op.batch_alter_table('messages', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('messages_convo_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('messages_convo_fkey', 'conversations', ['convo'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('messages_convo_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('messages_convo_fkey', 'conversations', ['convo'], ['id'])
+
+    with op.batch_alter_table('jobs', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('jobs_audio_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('jobs_audio_fkey', 'audios', ['audio'], ['id'])
+
+    with op.batch_alter_table('audios', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint('audios_prompt_fkey', type_='foreignkey')
+        batch_op.drop_constraint('audios_chat_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('audios_chat_fkey', 'conversations', ['chat'], ['id'])
+        batch_op.create_foreign_key('audios_prompt_fkey', 'messages', ['prompt'], ['id'])
+        batch_op.drop_index(batch_op.f('ix_audios_link'))
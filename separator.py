@@ -1,6 +1,103 @@
 import sys
 import os
-import demucs.separate
+import gc
+import hashlib
+import shutil
+import threading
+import time
+from multiprocessing.connection import Listener
+
+DEMUCS_MODEL_NAME = "htdemucs_ft"
+MP3_BITRATE = 320
+
+
+def stem_info(name, path, duration):
+    # One entry of the stem manifest the API stores when a job completes
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return {"name": name, "size": os.path.getsize(path), "duration": round(duration, 3), "sha256": digest.hexdigest()}
+
+
+class SeparationWorker:
+    """Keeps the Demucs model loaded so each job only pays for the separation itself.
+
+    Importing torch/demucs and loading the 4-model htdemucs_ft bag takes far longer
+    than separating one 30 s clip, so the service mode below loads it once and then
+    serves jobs until it is stopped.
+    """
+
+    def __init__(self, model_name=DEMUCS_MODEL_NAME):
+        import torch
+        from demucs.pretrained import get_model
+
+        started = time.monotonic()
+        self.torch = torch
+        self.model_name = model_name
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = get_model(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.load_seconds = time.monotonic() - started
+        print(f"Loaded Demucs model {model_name} on {self.device} in {self.load_seconds:.1f}s")
+
+    def separate(self, input_file, output_dir):
+        from demucs.apply import apply_model
+        from demucs.audio import save_audio
+        from demucs.separate import load_track
+
+        if not os.path.exists(input_file):
+            raise FileNotFoundError(f"Input file not found at {input_file}")
+        started = time.monotonic()
+        track = os.path.splitext(os.path.basename(input_file))[0]
+        final_dir = os.path.join(output_dir, self.model_name, track)
+        # Stems are written next to the final directory and moved in place at the end,
+        # so readers never see a half-written set
+        work_dir = f"{final_dir}.tmp"
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+
+        wav = load_track(input_file, self.model.audio_channels, self.model.samplerate)
+        ref = wav.mean(0)
+        wav -= ref.mean()
+        wav /= ref.std()
+        loaded = time.monotonic()
+        with self.torch.no_grad():
+            sources = apply_model(self.model, wav[None], device=self.device, shifts=1, split=True,
+                                  overlap=0.25, progress=False, num_workers=0)[0]
+        sources *= ref.std()
+        sources += ref.mean()
+        separated = time.monotonic()
+
+        duration = sources.shape[-1] / self.model.samplerate
+        stems = []
+        for source, name in zip(sources, self.model.sources):
+            stem_path = os.path.join(work_dir, f"{name}.mp3")
+            save_audio(source, stem_path, samplerate=self.model.samplerate,
+                       bitrate=MP3_BITRATE, clip="rescale", bits_per_sample=16, as_float=False)
+            stems.append(stem_info(name, stem_path, duration))
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(work_dir, final_dir)
+        saved = time.monotonic()
+
+        # Free the tensors before the next job instead of letting them pile up
+        del wav, ref, sources
+        gc.collect()
+        if self.device == "cuda":
+            self.torch.cuda.empty_cache()
+
+        return {
+            "track": track,
+            "model": self.model_name,
+            "output_dir": final_dir,
+            "stems": stems,
+            "decode_seconds": round(loaded - started, 3),
+            "separate_seconds": round(separated - loaded, 3),
+            "save_seconds": round(saved - separated, 3),
+            "total_seconds": round(saved - started, 3),
+        }
+
 
 def separate_audio(input_file, output_dir):
 
@@ -12,23 +109,68 @@ def separate_audio(input_file, output_dir):
 
     print(f"Starting Demucs separation for: {input_file}")
 
-    # Run the separation using a high-quality model, saving as MP3
-    demucs.separate.main([
-        "-n", "htdemucs_ft",
-        "-o", output_dir,
-        "--mp3",
-        "--mp3-bitrate", "320",
-        input_file
-    ])
+    result = SeparationWorker().separate(input_file, output_dir)
 
-    print("Demucs separation complete.")
+    print(f"Demucs separation complete in {result['total_seconds']}s.")
+
+
+def serve(address, authkey):
+    # Long-lived separation service: jobs arrive as dicts over multiprocessing connections
+    # ({"input": ..., "output": ..., "threads": ...}) and are answered with the per-job timing report.
+    host, port = address.rsplit(":", 1)
+    listener = Listener((host, int(port)), authkey=authkey)
+    worker = SeparationWorker()
+    model_lock = threading.Lock()
+    jobs_done = 0
+
+    def handle(conn):
+        nonlocal jobs_done
+        with conn:
+            while True:
+                try:
+                    job = conn.recv()
+                except (EOFError, OSError):
+                    return
+                queued = time.monotonic()
+                try:
+                    with model_lock:
+                        waited = time.monotonic() - queued
+                        if job.get("threads"):
+                            worker.torch.set_num_threads(job["threads"])
+                        result = worker.separate(job["input"], job["output"])
+                        jobs_done += 1
+                    result.update(ok=True, wait_seconds=round(waited, 3), jobs_done=jobs_done)
+                    print(f"Separated {result['track']} in {result['total_seconds']}s "
+                          f"(separate {result['separate_seconds']}s, waited {result['wait_seconds']}s)")
+                except Exception as e:
+                    print(f"Separation of {job.get('input')} failed: {e}", file=sys.stderr)
+                    result = {"ok": False, "error": str(e)}
+                try:
+                    conn.send(result)
+                except (EOFError, OSError):
+                    return
+
+    print(f"Separation service listening on {address}")
+    while True:
+        conn = listener.accept()
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
 
 
 # run script from the command line
 if __name__ == '__main__':
+    # python separator.py --serve <host:port>  (authkey is read from SEPARATION_AUTHKEY)
+    if len(sys.argv) == 3 and sys.argv[1] == "--serve":
+        authkey = os.environ.get("SEPARATION_AUTHKEY")
+        if not authkey:
+            print("SEPARATION_AUTHKEY must be set to run the separation service", file=sys.stderr)
+            sys.exit(1)
+        serve(sys.argv[2], authkey.encode())
+        sys.exit(0)
+
     # Expects two command line arguments, the input file and the output directory
     if len(sys.argv) != 3:
         print("Usage: python separator.py <input_file_path> <output_directory_path>", file=sys.stderr)
+        print("       python separator.py --serve <host:port>", file=sys.stderr)
         sys.exit(1)
 
     input_path = sys.argv[1]